@@ -0,0 +1,31 @@
+# generates synthetic archives of zephyrgrams (see synthetic.py).
+# run it as "python -m bench.archive --messages N path" from the top of the
+# repository.
+
+import argparse
+
+from db import Database
+from synthetic import ArchiveApp, ArchiveGenerator
+
+def build_archive(path, count, seed=0, batch_size=10000):
+    # writes count messages to the database at path, in batches
+    generator = ArchiveGenerator(seed)
+    with Database(ArchiveApp(path)) as db:
+        remaining = count
+        while remaining > 0:
+            batch = list(generator.messages(min(batch_size, remaining)))
+            db.append_messages(batch)
+            remaining -= len(batch)
+
+def main():
+    parser = argparse.ArgumentParser(description=
+        'Generate a synthetic archive of zephyrgrams.')
+    parser.add_argument('path')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    build_archive(args.path, args.messages, args.seed)
+
+if __name__ == '__main__':
+    main()
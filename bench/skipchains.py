@@ -0,0 +1,120 @@
+# benchmark for the filter optimizer: measures queries using the filters
+# built by repeatedly skipping threads with "s", with and without
+# optimizing them first.
+# run it as "python -m bench.skipchains" from the top of the repository.
+
+import argparse
+import random
+import time
+
+from datetime import datetime
+
+from db import Database
+from filterexpr import to_sql
+from filtering import (ConjunctionFilter, NegationFilter, ParsedFilter,
+    RelatedFilter)
+from zephyrgram import Zephyrgram
+
+PRINCIPAL = 'me@ATHENA.MIT.EDU'
+
+class App:
+    principal = PRINCIPAL
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_database_path(self):
+        return self.path
+
+class UnoptimizedFilter:
+    # the same filter, but with SQL generated from its tree as built
+    def __init__(self, filter):
+        self.sql, self.params = to_sql(filter.source_expr)
+
+    def to_sql(self):
+        return self.sql
+
+    def sql_params(self):
+        return self.params
+
+def make_messages(rng, count, threads):
+    messages = []
+    for i in range(count):
+        thread = rng.randrange(threads)
+        messages.append(Zephyrgram(rowid=None,
+            sender='user{}@ATHENA.MIT.EDU'.format(rng.randrange(50)),
+            class_=rng.choice(['', 'un', 'Un']) + 'class{}'.format(thread),
+            instance=rng.choice(['personal', 'Personal.d', 'urgent']),
+            recipient='*',
+            opcode='',
+            auth=True,
+            time=datetime.now(),
+            signature='user',
+            body='message {} in thread {}'.format(i, thread)))
+    return messages
+
+def thread_index(message):
+    return int(message.class_.lstrip('unU')[len('class'):])
+
+def skip_chain(app, base, messages, length, threads):
+    # what pressing "s" length times would build, cycling through the
+    # given number of threads
+    filter = base
+    for i in range(length):
+        filter = ConjunctionFilter(filter,
+            NegationFilter(RelatedFilter(app, messages[i % threads],
+                class_only=True)))
+    return filter
+
+def measure(db, filter, repeat):
+    # best time, in milliseconds, of counting and paging through all
+    # messages accepted by the filter
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        db.count_messages_after(-1, filter)
+        db.advance(db.first_index(), 100, filter)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=
+        'Benchmark queries using chains of skipped threads.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--threads', type=int, default=5,
+        help='number of distinct threads skipped in a chain')
+    parser.add_argument('--max-length', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    app = App(':memory:')
+
+    with Database(app) as db:
+        db.append_messages(make_messages(rng, args.messages, 100))
+
+        # one message from each of the threads we will skip
+        skipped = []
+        for message in db.get_messages_starting_with(0):
+            if thread_index(message) == len(skipped):
+                skipped.append(message)
+                if len(skipped) == args.threads:
+                    break
+
+        base = ParsedFilter('sender is not "user0@*"')
+        print('{:>6} {:>10} {:>10} {:>12} {:>12}'.format('length',
+            'sql bytes', 'raw bytes', 'ms', 'raw ms'))
+        length = 1
+        while length <= args.max_length:
+            filter = skip_chain(app, base, skipped, length, args.threads)
+            unoptimized = UnoptimizedFilter(filter)
+            print('{:>6} {:>10} {:>10} {:>12.2f} {:>12.2f}'.format(length,
+                len(filter.to_sql()), len(unoptimized.to_sql()),
+                measure(db, filter, args.repeat),
+                measure(db, unoptimized, args.repeat)))
+            length *= 2
+
+if __name__ == '__main__':
+    main()
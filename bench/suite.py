@@ -0,0 +1,262 @@
+# times the database queries, filters, ingestion and rendering on a
+# synthetic archive, and writes the results as JSON, to be compared across
+# versions.
+# run it as "python -m bench.suite --messages N" from the top of the
+# repository; the archive is generated (and kept) in the --archive path if
+# it doesn't exist yet.
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.archive import build_archive
+from configmanager import ConfigManager
+from db import Database
+from filtering import (ConjunctionFilter, NegationFilter, NopFilterSingleton,
+    ParsedFilter, RelatedFilter)
+from synthetic import ArchiveApp, ArchiveGenerator
+from ui.mainwindow import MainWindow
+from ui.render import RenderScheduler
+from ui.screen import VirtualScreen
+from ui.statusbar import StatusBar
+
+class HeadlessApp(ArchiveApp):
+    # the parts of Wagtail that the windows need, drawing to a VirtualScreen
+    def __init__(self, path, db, config_dir, lines, cols):
+        super().__init__(path)
+        self.config_dir = config_dir
+        self.config = ConfigManager(self)
+        self.db = db
+        self.screen = VirtualScreen(lines, cols)
+        self.window_stack = []
+        self.renderer = RenderScheduler(self)
+        self.status_bar = StatusBar(self)
+        self.main_window = MainWindow(self)
+        self.window_stack = [self.status_bar, self.main_window]
+
+    def get_config_path(self):
+        return os.path.join(self.config_dir, 'config.py')
+
+class Suite:
+    def __init__(self, db, rng, repeat, only):
+        self.db = db
+        self.rng = rng
+        self.repeat = repeat
+        self.only = only
+        self.results = {}
+
+        self.first = db.first_index()
+        self.last = db.last_index()
+
+    def random_index(self):
+        return self.rng.randint(self.first, self.last)
+
+    def time(self, name, fn, calls=1, **extra):
+        # runs fn self.repeat times, and records the time per call, given
+        # that each run makes the given number of calls
+        if (self.only is not None) and not name.startswith(self.only):
+            return
+
+        fn() # warm up the caches
+        times = []
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - start) / calls)
+
+        self.results[name] = dict(extra,
+            runs=self.repeat,
+            calls=calls,
+            best=min(times),
+            median=statistics.median(times),
+            mean=statistics.mean(times))
+        print('{:<45} {:>12.6f} ms'.format(name, min(times) * 1000),
+            file=sys.stderr)
+
+    def random_calls(self, calls, fn):
+        # calls fn with the same random indices on every run
+        indices = [self.random_index() for i in range(calls)]
+        return lambda: [fn(index) for index in indices]
+
+    def filters(self):
+        messages = self.db.get_messages_between(self.first, self.last + 1,
+            limit=1000)
+        personal = next(m for m in messages if m.is_personal())
+        public = next(m for m in messages if not m.is_personal())
+        app = ArchiveApp(None)
+
+        chain = NopFilterSingleton
+        for message in [m for m in messages if not m.is_personal()][:16]:
+            chain = ConjunctionFilter(chain,
+                NegationFilter(RelatedFilter(app, message)))
+
+        return {
+            'nop': NopFilterSingleton,
+            'parsed_glob': ParsedFilter('class_ is "help*"'),
+            'parsed_compare': ParsedFilter(
+                'sender == "user1@ATHENA.MIT.EDU" and opcode != "auto"'),
+            'parsed_fulltext': ParsedFilter('"kerberos ticket" in body'),
+            'related_personal': RelatedFilter(app, personal),
+            'related_class': RelatedFilter(app, public, class_only=True),
+            'related_instance': RelatedFilter(app, public),
+            'negation': NegationFilter(RelatedFilter(app, public,
+                class_only=True)),
+            'conjunction': ConjunctionFilter(
+                ParsedFilter('class_ is "help*"'),
+                NegationFilter(RelatedFilter(app, personal))),
+            'skip_chain_16': chain,
+        }
+
+    def run_queries(self):
+        db = self.db
+        self.time('first_index', db.first_index)
+        self.time('last_index', db.last_index)
+
+        for delta in (1, -1, 100, -100):
+            self.time('advance[{:+d}]'.format(delta),
+                self.random_calls(100, lambda index, delta=delta:
+                    db.advance(index, delta)), calls=100)
+
+        self.time('count_messages_after',
+            self.random_calls(20, db.count_messages_after), calls=20)
+        self.time('get_messages_starting_with[50]',
+            self.random_calls(20, lambda index:
+                list(db.get_messages_starting_with(index, limit=50))),
+            calls=20)
+
+        for name, filter in self.filters().items():
+            # self.time runs these right away, so they can use filter
+            self.time('filter[{}].first_index'.format(name),
+                lambda: db.first_index(filter))
+            self.time('filter[{}].count_messages_after'.format(name),
+                lambda: db.count_messages_after(-1, filter))
+            self.time('filter[{}].advance[+1]'.format(name),
+                self.random_calls(20,
+                    lambda index: db.advance(index, 1, filter)), calls=20)
+
+    def run_ingest(self, batch_size, count, writer_thread):
+        name = 'ingest[batch={},writer={}]'.format(batch_size,
+            'thread' if writer_thread else 'none')
+        generator = ArchiveGenerator(seed=self.rng.randrange(2 ** 32))
+        batches = [list(generator.messages(batch_size))
+            for i in range(max(1, count // batch_size))]
+
+        def ingest():
+            with tempfile.TemporaryDirectory() as directory:
+                app = ArchiveApp(os.path.join(directory, 'ingest.sqlite3'))
+                with Database(app, writer_thread=writer_thread) as db:
+                    for batch in batches:
+                        for message in batch:
+                            message.rowid = None
+                        db.ingest(batch, callback=lambda result: None)
+
+        total = batch_size * len(batches)
+        self.time(name, ingest, calls=total)
+        if name in self.results:
+            self.results[name]['messages_per_second'] = \
+                1 / self.results[name]['best']
+
+    def run_redraw(self, lines, cols):
+        with tempfile.TemporaryDirectory() as directory:
+            app = HeadlessApp(None, self.db, directory, lines, cols)
+            window = app.main_window
+            app.renderer.render(force=True)
+
+            def full():
+                window.drawn = None
+                app.renderer.mark_dirty(window)
+                app.renderer.render(force=True)
+
+            def scroll():
+                for i in range(20):
+                    window.handle_keypress('j')
+                    app.renderer.render(force=True)
+                for i in range(20):
+                    window.handle_keypress('k')
+                    app.renderer.render(force=True)
+
+            # we also record what drawing cost, per call
+            for name, fn, calls in (('full', full, 1), ('scroll', scroll, 40)):
+                key = 'redraw[{},{}x{}]'.format(name, lines, cols)
+                before = app.screen.metrics()
+                self.time(key, fn, calls=calls)
+                if key in self.results:
+                    after = app.screen.metrics()
+                    total_calls = (self.repeat + 1) * calls
+                    self.results[key]['screen_per_call'] = {
+                        k: (after[k] - before[k]) / total_calls
+                        for k in after}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=
+        'Benchmark wagtail on a synthetic archive.')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--archive', default=None,
+        help='path of the archive (default: bench-N.sqlite3 in /tmp)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', default=None,
+        help='only run benchmarks whose names start with this')
+    parser.add_argument('--output', default=None,
+        help='where to write the JSON results (default: stdout)')
+    args = parser.parse_args()
+
+    path = args.archive or os.path.join(tempfile.gettempdir(),
+        'wagtail-bench-{}-{}.sqlite3'.format(args.messages, args.seed))
+    if not os.path.exists(path):
+        print('generating {} messages in {}'.format(args.messages, path),
+            file=sys.stderr)
+        start = time.perf_counter()
+        build_archive(path, args.messages, args.seed)
+        print('done in {:.1f}s'.format(time.perf_counter() - start),
+            file=sys.stderr)
+
+    rng = random.Random(args.seed)
+    with Database(ArchiveApp(path)) as db:
+        suite = Suite(db, rng, args.repeat, args.only)
+        suite.run_queries()
+        for batch_size in (1, 256):
+            for writer_thread in (False, True):
+                suite.run_ingest(batch_size, 2048, writer_thread)
+        suite.run_redraw(50, 120)
+
+    output = {
+        'meta': {
+            'revision': git_revision(),
+            'time': time.time(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'archive': path,
+            'messages': suite.last - suite.first + 1,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': suite.results,
+    }
+
+    if args.output is None:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
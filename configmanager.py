@@ -1,3 +1,4 @@
+import collections
 import importlib
 import importlib.util
 import os
@@ -5,8 +6,18 @@ import os.path
 import shutil
 import sys
 
+from styling import StyleRules
+
 EXPECTED_CONFIG_VERSION = 1
 
+DISPLAY_PROPERTIES_CACHE_SIZE = 4096
+
+def uncached(function):
+    # decorator for functions in the config whose results must not be
+    # memoized, e.g. because they depend on the current time
+    function.uncached = True
+    return function
+
 class ConfigManager:
     def __init__(self, app):
         self.path = app.get_config_path()
@@ -19,14 +30,29 @@ class ConfigManager:
                     'example_config.py'),
                 self.path)
 
+        # incremented on every reload, so that anything computed from the
+        # configuration can tell when it is out of date
+        self.generation = 0
+
         self.module_name = 'wagtail_user_config'
         self.spec = importlib.util.spec_from_file_location(self.module_name,
             self.path)
         self.reload()
 
     def reload(self):
-        self.module = importlib.util.module_from_spec(self.spec)
-        self.spec.loader.exec_module(self.module)
+        module = importlib.util.module_from_spec(self.spec)
+        self.spec.loader.exec_module(module)
+        # if the rules are invalid, this raises ValueError, and we keep the
+        # previous version of the config (if there is one)
+        styles = StyleRules(getattr(module, 'style_rules', []))
+
+        self.module = module
+        self.styles = styles
+        self.generation += 1
+
+        # display properties of messages, keyed by (rowid, is_current,
+        # wrap_mode), for the current version of the config
+        self.display_properties = collections.OrderedDict()
 
         self.check_version()
 
@@ -37,6 +63,40 @@ class ConfigManager:
                 'version {} found.').format(EXPECTED_CONFIG_VERSION,
                     self.module.version))
 
+    def get_zgram_display_properties(self, zgram, is_current, wrap_mode):
+        # the returned dict is shared between calls, and must not be modified
+        if self.volatile_display_properties() or (zgram.rowid is None):
+            return self.compute_zgram_display_properties(zgram, is_current,
+                wrap_mode)
+
+        key = (zgram.rowid, is_current, wrap_mode)
+        properties = self.display_properties.get(key)
+        if properties is not None:
+            self.display_properties.move_to_end(key)
+            return properties
+
+        properties = self.compute_zgram_display_properties(zgram, is_current,
+            wrap_mode)
+        self.display_properties[key] = properties
+        if len(self.display_properties) > DISPLAY_PROPERTIES_CACHE_SIZE:
+            self.display_properties.popitem(last=False)
+        return properties
+
+    def volatile_display_properties(self):
+        # whether display properties can change without the config being
+        # reloaded, so messages have to be redrawn on every frame
+        function = getattr(self.module, 'get_zgram_display_properties', None)
+        return getattr(function, 'uncached', False)
+
+    def compute_zgram_display_properties(self, zgram, is_current, wrap_mode):
+        # the properties returned by the config's function, if any, with
+        # those set by the first matching style rule on top
+        properties = {}
+        if hasattr(self.module, 'get_zgram_display_properties'):
+            properties = self.module.get_zgram_display_properties(zgram,
+                is_current, wrap_mode)
+        return self.styles.apply(zgram, properties, is_current, wrap_mode)
+
     def __getattr__(self, name):
         if hasattr(self.module, name):
             return getattr(self.module, name)
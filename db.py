@@ -1,20 +1,135 @@
+import collections
+import concurrent.futures
+import functools
+import queue
 import sqlite3
+import threading
+import time
 
+from datetime import datetime
+
+from filterexpr import fulltext_query
 from filtering import NopFilterSingleton
-from util import take_unprefix
+from instrumentation import format_query_plan, stats, timed, trace_statement
+from subscriptions import SubscriptionIndex
+from util import instance_thread_key, take_unprefix, thread_key, to_epoch_us
 from zephyrgram import Zephyrgram
 
-class Database:
-    def __init__(self, app):
-        self.db = sqlite3.connect(app.get_database_path(),
-            detect_types=sqlite3.PARSE_DECLTYPES)
-        self.db.row_factory = sqlite3.Row
+sqlite3.register_adapter(bool, lambda x: int(x))
+
+SCHEMA_VERSION = 4
+
+# how many distinct (query, filter) statements we keep prepared
+STATEMENT_CACHE_SIZE = 256
+
+# the columns of messages that Zephyrgram.from_sql uses. the methods that
+# read messages can be given a subset of these (which must include id) to
+# read instead, e.g. ('id', 'body'); the fields of the messages they return
+# that come from other columns can't be used.
+MESSAGE_COLUMNS = ('id', 'sender', 'class', 'instance', 'recipient',
+    'opcode', 'auth', 'time', 'signature', 'body')
+
+@functools.lru_cache()
+def select_list(columns):
+    return ', '.join('messages.{}'.format(column) for column in columns)
+
+def connect(path):
+    # we don't let the sqlite3 module convert values by their declared
+    # types: Zephyrgram decodes the fields it needs itself
+    db = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+    db.row_factory = sqlite3.Row
+    db.create_function('thread_key', 1, thread_key, deterministic=True)
+    db.create_function('instance_thread_key', 1, instance_thread_key,
+        deterministic=True)
+    db.set_trace_callback(trace_statement)
+    return db
+
+class DatabaseWriter:
+    # runs write jobs, one transaction each, on a background thread with its
+    # own connection, so that the UI thread never has to wait for a commit.
+    # results of jobs submitted with submit() are handed back to the UI
+    # thread through run_callbacks(), and notify() is called to wake it up.
+    def __init__(self, path, notify):
+        self.path = path
+        self.notify = notify
+
+        self.jobs = queue.Queue()
+        self.completed = queue.Queue()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        db = connect(self.path)
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            future, fn, args = job
+            start = time.perf_counter()
+            try:
+                with db:
+                    result = fn(db, *args)
+            except Exception as error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+            stats.record('db.write', time.perf_counter() - start)
+
+        with db:
+            db.execute('PRAGMA optimize')
+        db.close()
+
+    def submit(self, fn, *args, callback=None):
+        future = concurrent.futures.Future()
+
+        if callback is not None:
+            def done(future):
+                self.completed.put((callback, future))
+                self.notify()
+            future.add_done_callback(done)
+
+        self.jobs.put((future, fn, args))
+        return future
+
+    def call(self, fn, *args):
+        # blocks until the job has been committed
+        return self.submit(fn, *args).result()
+
+    def run_callbacks(self):
+        while not self.completed.empty():
+            callback, future = self.completed.get()
+            callback(future.result())
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
 
-        sqlite3.register_converter('BOOL', lambda x: bool(int(x)))
-        sqlite3.register_adapter(bool, lambda x: int(x))
+class Database:
+    def __init__(self, app, writer_thread=False, profiler=None):
+        self.path = app.get_database_path()
+        self.db = connect(self.path)
+        self.statements = collections.OrderedDict()
+        # an instrumentation.QueryProfiler, if queries should be profiled
+        self.profiler = profiler
 
         self.initialize_schema()
 
+        # the subscriptions table is small and read for every incoming
+        # message, so we keep a copy of it. the methods below change both.
+        self.subscriptions = SubscriptionIndex(self.db.execute('''
+            SELECT class, instance, recipient, undepth
+            FROM subscriptions''').fetchall())
+
+        self.writer = None
+        if writer_thread:
+            # in WAL mode, readers never wait for the writer (and vice
+            # versa), so self.db becomes a read-only connection for the UI
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.writer = DatabaseWriter(self.path, app.wakeup)
+
     def __enter__(self):
         return self
 
@@ -22,6 +137,9 @@ class Database:
         self.close()
 
     def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
         with self.db:
             self.db.execute('PRAGMA optimize')
         self.db.close()
@@ -34,7 +152,8 @@ class Database:
             AND name = 'version' ''').fetchone()
 
         if version_table is None:
-            # database does not exist
+            # database does not exist. we create the version 1 schema and
+            # let the migrations below bring it up to date.
             with self.db:
                 self.db.execute('''
                     CREATE TABLE version
@@ -61,14 +180,53 @@ class Database:
                      recipient TEXT NOT NULL,
                      undepth INTEGER NOT NULL,
                      PRIMARY KEY (class, instance, recipient))''')
-        else:
-            # database exists, must check version and migrate if necessary
-            version, = self.db.execute('SELECT version FROM version').fetchone()
 
-            assert version == 1
+        # database exists, must check version and migrate if necessary
+        version, = self.db.execute('SELECT version FROM version').fetchone()
+
+        assert 1 <= version <= SCHEMA_VERSION
 
-    def get_message(self, index):
-        cursor = self.db.execute('SELECT * FROM messages WHERE id=?', (index, ))
+        while version < SCHEMA_VERSION:
+            with self.db:
+                _migrations[version](self.db)
+                version += 1
+                self.db.execute('UPDATE version SET version = ?', (version, ))
+
+    def execute(self, statement, params=(), filter=NopFilterSingleton):
+        # runs a statement on the UI thread's connection. filter is the
+        # filter the statement was built from, for the profiler.
+        if self.profiler is None:
+            return self.db.execute(statement, params)
+
+        # this only times sqlite finding the first row, which is where
+        # aggregates and most searches do all their work
+        start = time.perf_counter()
+        cursor = self.db.execute(statement, params)
+        self.profiler.record(self, filter.name(), statement, params,
+            time.perf_counter() - start)
+        return cursor
+
+    def query_plan(self, statement, params):
+        return self.db.execute('EXPLAIN QUERY PLAN ' + statement,
+            params).fetchall()
+
+    def explain(self, filter):
+        # returns (statement, plan lines) for the statements recently run
+        # with the filter, most recent first, so that we can see how sqlite
+        # runs the filter
+        filter_sql = filter.to_sql()
+        result = []
+        for (_, sql), (statement, params) in reversed(
+            self.statements.items()):
+            if sql == filter_sql:
+                result.append((statement, format_query_plan(
+                    self.query_plan(statement, params))))
+        return result
+
+    @timed('db.get_message')
+    def get_message(self, index, columns=MESSAGE_COLUMNS):
+        cursor = self.execute('SELECT {} FROM messages WHERE id=?'.format(
+            select_list(columns)), (index, ))
         result = cursor.fetchone()
 
         if result is None:
@@ -76,178 +234,516 @@ class Database:
 
         return Zephyrgram.from_sql(result)
 
-    def append_message(self, msg):
+    def write(self, fn, *args):
+        # runs fn(connection, *args) in a transaction and returns its result
+        if self.writer is None:
+            return self._write_here(fn, *args)
+        return self.writer.call(fn, *args)
+
+    @timed('db.write')
+    def _write_here(self, fn, *args):
         with self.db:
-            self.db.execute('''
-                INSERT INTO messages
-                (id, sender, class, instance, recipient, opcode, auth, time,
-                 signature, body)
-                VALUES (:id, :sender, :class, :instance, :recipient, :opcode,
-                        :auth, :time, :signature, :body)''',
-                msg.to_sql())
+            return fn(self.db, *args)
+
+    def submit_write(self, fn, *args, callback):
+        # like write(), but doesn't wait for the result if there is a writer
+        # thread. callback(result) is called on the UI thread once the
+        # transaction is committed (from run_write_callbacks()).
+        if self.writer is None:
+            callback(self._write_here(fn, *args))
+        else:
+            self.writer.submit(fn, *args, callback=callback)
+
+    @timed('db.write_callbacks')
+    def run_write_callbacks(self):
+        if self.writer is not None:
+            self.writer.run_callbacks()
+
+    def append_message(self, msg):
+        self.append_messages([msg])
+
+    def append_messages(self, msgs):
+        return self.write(_insert_messages, msgs)
+
+    def ingest(self, msgs, callback):
+        # stores a batch of incoming messages and raises the undepth of any
+        # subscriptions that they show to be un-classed, all in a single
+        # transaction. once that is committed, callback is called with the
+        # rowids of the new messages and the list of (class, instance,
+        # recipient) triples that we should newly subscribe to.
+        # the subscriptions are checked against self.subscriptions, so the
+        # transaction only touches the subscriptions table if some undepth
+        # was actually raised.
+        raised, new_subs = self.subscriptions.observe(msgs)
+        self.submit_write(_ingest, msgs, raised,
+            callback=lambda rowids: callback((rowids, new_subs)))
+
+    def execute_filtered(self, sql, filter, params=(), params_after=()):
+        # executes a query containing the filter's SQL in place of {}.
+        # params are the values for the placeholders before the filter, and
+        # params_after for the ones after it.
+        # the sqlite3 module keeps the statements it has prepared, keyed by
+        # their text, so running the same query with the same filter reuses
+        # its prepared statement. self.statements keeps the text of recent
+        # ones only so that we don't format it again on every call, and with
+        # the last parameters each was run with, so that explain() can show
+        # its query plan.
+        key = (sql, filter.to_sql())
+        params = params + filter.sql_params() + params_after
+        entry = self.statements.get(key)
+        if entry is None:
+            entry = [sql.format(filter.to_sql()), params]
+            self.statements[key] = entry
+            if len(self.statements) > STATEMENT_CACHE_SIZE:
+                self.statements.popitem(last=False)
+        else:
+            entry[1] = params
+            self.statements.move_to_end(key)
+
+        return self.execute(entry[0], params, filter)
 
+    @timed('db.first_index')
     def first_index(self, filter=NopFilterSingleton):
         # returns None on empty database
-        return self.db.execute('SELECT min(id) FROM messages WHERE {}'
-            .format(filter.to_sql())).fetchone()[0]
+        return self.execute_filtered('SELECT min(id) FROM messages WHERE {}',
+            filter).fetchone()[0]
 
+    @timed('db.last_index')
     def last_index(self, filter=NopFilterSingleton):
         # returns None on empty database
-        return self.db.execute('SELECT max(id) FROM messages WHERE {}'
-            .format(filter.to_sql())).fetchone()[0]
+        return self.execute_filtered('SELECT max(id) FROM messages WHERE {}',
+            filter).fetchone()[0]
+
+    @timed('db.first_index_at')
+    def first_index_at(self, time, filter=NopFilterSingleton):
+        # returns the rowid of the earliest message sent at or after time (a
+        # datetime), or None if there is none. with the index on time, this
+        # is a single seek (unless the filter rejects many of the messages
+        # after it).
+        result = self.execute_filtered('''
+            SELECT id FROM messages
+            WHERE time >= ?
+            AND ({})
+            ORDER BY time ASC, id ASC
+            LIMIT 1''', filter, (to_epoch_us(time), )).fetchone()
+        return None if result is None else result[0]
 
+    @timed('db.advance')
     def advance(self, index, delta, filter=NopFilterSingleton):
         # index might not refer to an existing rowid (or one that is
         # accepted by the given filter), but the result must.
         # thus advance(index, 0) is a valid way to find a rowid closest
         # to the rowid of a potentially deleted/hidden message.
         if delta == 0:
-            result = self.db.execute('''
+            result = self.execute_filtered('''
                 SELECT id FROM messages
                 WHERE id >= ?
                 AND ({})
                 ORDER BY id ASC
-                LIMIT 1'''.format(filter.to_sql()), (index, )).fetchone()
+                LIMIT 1''', filter, (index, )).fetchone()
 
             if result is None:
                 return self.last_index(filter=filter)
 
             return result[0]
         elif delta < 0:
-            result = self.db.execute('''
-                SELECT id FROM messages
-                WHERE id < ?
-                AND ({})
-                ORDER BY id DESC
-                LIMIT 1 OFFSET ?'''.format(filter.to_sql()),
-                (index, abs(delta) - 1)).fetchone()
+            # instead of skipping rows with OFFSET, we read the whole range
+            # of rows we are moving across in one go. this way, running
+            # past the first message doesn't need a second query.
+            result, = self.execute_filtered('''
+                SELECT min(id) FROM
+                    (SELECT id FROM messages
+                     WHERE id < ?
+                     AND ({})
+                     ORDER BY id DESC
+                     LIMIT ?)''', filter, (index, ), (abs(delta), )).fetchone()
 
             if result is None:
                 return self.first_index(filter=filter)
-            return result[0]
+            return result
         elif delta > 0:
-            result = self.db.execute('''
-                SELECT id FROM messages
-                WHERE id > ?
-                AND ({})
-                ORDER BY id ASC
-                LIMIT 1 OFFSET ?'''.format(filter.to_sql()),
-                (index, delta - 1)).fetchone()
+            result, = self.execute_filtered('''
+                SELECT max(id) FROM
+                    (SELECT id FROM messages
+                     WHERE id > ?
+                     AND ({})
+                     ORDER BY id ASC
+                     LIMIT ?)''', filter, (index, ), (delta, )).fetchone()
 
             if result is None:
                 return self.last_index(filter=filter)
-            return result[0]
-
-    def get_messages_starting_with(self, index, filter=NopFilterSingleton):
-        cursor = self.db.execute('''
-            SELECT * FROM messages
+            return result
+
+    @timed('db.get_page')
+    def get_page(self, index, line_budget, measure, backwards=False,
+        filter=NopFilterSingleton, columns=MESSAGE_COLUMNS):
+        # returns the rowids, in ascending order, of the messages that fill
+        # a page of line_budget lines right after index (or right before
+        # it, if backwards is set). measure(message) must return the number
+        # of lines that a message takes up. the page always contains at
+        # least one message, unless there are none to be had.
+        # every message is at least one line tall, so we never need more
+        # than line_budget rows, which we get with a single range read.
+        # measure is given messages with just the given columns.
+        if backwards:
+            cursor = self.execute_filtered('''
+                SELECT {} FROM messages
+                WHERE id < ?
+                AND ({{}})
+                ORDER BY id DESC
+                LIMIT ?'''.format(select_list(columns)), filter, (index, ),
+                (line_budget, ))
+        else:
+            cursor = self.execute_filtered('''
+                SELECT {} FROM messages
+                WHERE id > ?
+                AND ({{}})
+                ORDER BY id ASC
+                LIMIT ?'''.format(select_list(columns)), filter, (index, ),
+                (line_budget, ))
+
+        page = []
+        lines = 0
+        for row in cursor:
+            message = Zephyrgram.from_sql(row)
+            lines += measure(message)
+            if (lines > line_budget) and (len(page) > 0):
+                break
+            page.append(message.rowid)
+
+        if backwards:
+            page.reverse()
+        return page
+
+    def get_messages_starting_with(self, index, filter=NopFilterSingleton,
+        limit=-1, columns=MESSAGE_COLUMNS):
+        cursor = self.execute_filtered('''
+            SELECT {} FROM messages
             WHERE id >= ?
-            AND ({})
-            ORDER BY id ASC'''.format(filter.to_sql()), (index, ))
+            AND ({{}})
+            ORDER BY id ASC
+            LIMIT ?'''.format(select_list(columns)), filter, (index, ),
+            (limit, ))
 
         row = cursor.fetchone()
         while row is not None:
             yield Zephyrgram.from_sql(row)
             row = cursor.fetchone()
 
+    @timed('db.get_messages_between')
+    def get_messages_between(self, start, stop, filter=NopFilterSingleton,
+        limit=-1, columns=MESSAGE_COLUMNS):
+        # returns messages with start <= rowid < stop, in ascending order
+        cursor = self.execute_filtered('''
+            SELECT {} FROM messages
+            WHERE id >= ?
+            AND id < ?
+            AND ({{}})
+            ORDER BY id ASC
+            LIMIT ?'''.format(select_list(columns)), filter, (start, stop),
+            (limit, ))
+
+        return [Zephyrgram.from_sql(row) for row in cursor]
+
+    @timed('db.count_messages_after')
     def count_messages_after(self, index, filter=NopFilterSingleton):
-        result, = self.db.execute('''
+        result, = self.execute_filtered('''
             SELECT count(*) FROM messages
             WHERE id > ?
-            AND ({})'''.format(filter.to_sql()), (index, )).fetchone()
+            AND ({})''', filter, (index, )).fetchone()
         return result
 
-    def get_subscriptions(self, expand_un=True):
-        cursor = self.db.execute('SELECT * FROM subscriptions')
+    @timed('db.count_messages_between')
+    def count_messages_between(self, after, up_to, filter=NopFilterSingleton):
+        # counts messages with after < rowid <= up_to
+        result, = self.execute_filtered('''
+            SELECT count(*) FROM messages
+            WHERE id > ?
+            AND id <= ?
+            AND ({})''', filter, (after, up_to)).fetchone()
+        return result
 
-        row = cursor.fetchone()
-        while row is not None:
+    @timed('db.search')
+    def search(self, text, limit=100, filter=NopFilterSingleton,
+        columns=MESSAGE_COLUMNS):
+        # returns up to limit messages accepted by the filter that contain
+        # all the words in text (in their body or signature), best matches
+        # first
+        cursor = self.execute_filtered('''
+            SELECT {} FROM messages_fts
+            JOIN messages ON messages.id = messages_fts.rowid
+            WHERE messages_fts MATCH ?
+            AND ({{}})
+            ORDER BY messages_fts.rank
+            LIMIT ?'''.format(select_list(columns)), filter,
+            (fulltext_query(text, ('body', 'signature')), ), (limit, ))
+
+        return [Zephyrgram.from_sql(row) for row in cursor]
+
+    def rebuild_fulltext_index(self):
+        self.write(_rebuild_fulltext_index)
+
+    def get_subscriptions(self, expand_un=True):
+        for row in self.subscriptions:
             class_, instance, recipient, undepth = row
             yield row
             if expand_un:
                 for i in range(1, undepth + 1):
                     yield (('un'*i) + class_, instance, recipient, 0)
 
-            row = cursor.fetchone()
-
     def subscribe(self, class_, instance, recipient):
-        undepth, class_stripped = take_unprefix(class_)
-
-        result = self.db.execute('''
-            SELECT undepth, rowid
-            FROM subscriptions
-            WHERE (class = ?)
-            AND (instance = ?)
-            AND (recipient = ?)''',
-            (class_stripped, instance, recipient)).fetchone()
-
-        if result is None:
-            with self.db:
-                self.db.execute('''
-                    INSERT INTO subscriptions
-                    VALUES (?, ?, ?, ?)''',
-                    (class_stripped, instance, recipient, undepth))
-            return [('un'*i + class_stripped, instance, recipient)
-                    for i in range(undepth + 1)]
-        else:
-            existing_undepth, rowid = result
-            if existing_undepth < undepth:
-                with self.db:
-                    self.db.execute('''
-                        UPDATE subscriptions
-                        SET undepth = ?
-                        WHERE rowid = ?''', (undepth, rowid))
-                return [('un'*i + class_stripped, instance, recipient)
-                        for i in range(existing_undepth + 1, undepth + 1)]
-            else:
-                return []
+        new_subs = self.subscriptions.subscribe(class_, instance, recipient)
+        if len(new_subs) > 0:
+            self.write(_subscribe, class_, instance, recipient)
+        return new_subs
+
+    def subscribe_many(self, triples):
+        # like subscribe() for each of the (class, instance, recipient)
+        # triples, in a single transaction
+        new_subs = []
+        changed = []
+        for triple in triples:
+            subs = self.subscriptions.subscribe(*triple)
+            if len(subs) > 0:
+                new_subs.extend(subs)
+                changed.append(triple)
+        if len(changed) > 0:
+            self.write(_subscribe_many, changed)
+        return new_subs
 
     def unsubscribe(self, class_, instance, recipient):
-        undepth, _ = take_unprefix(class_)
-        if undepth != 0:
-            # cannot unsubscribe from an unclass directly
-            # TODO: clear error message
-            return []
-
-        result = self.db.execute('''
-            SELECT undepth, rowid
-            FROM subscriptions
-            WHERE (class = ?)
-            AND (instance = ?)
-            AND (recipient = ?)''',
-            (class_, instance, recipient)).fetchone()
-
-        if result is None:
-            return []
-
-        existing_undepth, rowid = result
-
-        with self.db:
-            self.db.execute('''
-                DELETE FROM subscriptions
-                WHERE rowid = ?''', (rowid, ))
-
-        return [('un'*i + class_, instance, recipient)
-                for i in range(existing_undepth + 1)]
+        unsubs = self.subscriptions.unsubscribe(class_, instance, recipient)
+        if len(unsubs) > 0:
+            self.write(_unsubscribe, class_, instance, recipient)
+        return unsubs
 
     def update_undepth(self, class_, candidate_undepth):
-        # no need to run SQL queries if it's obvious nothing will change
-        if candidate_undepth == 0:
-            return []
-
-        affected = self.db.execute('''
-            SELECT instance, recipient
-            FROM subscriptions
-            WHERE (class = ?)
-            AND (undepth < ?)''', (class_, candidate_undepth)).fetchall()
-
-        if len(affected) == 0:
-            return []
-
-        with self.db:
-            self.db.execute('''
+        new_subs = self.subscriptions.raise_undepth(class_, candidate_undepth)
+        if len(new_subs) > 0:
+            self.write(_raise_undepths, {class_: candidate_undepth})
+        return new_subs
+
+# the functions below are write jobs: they are called with a connection that
+# they should use, inside a transaction (see Database.write)
+
+def _insert_messages(db, msgs):
+    # we assign rowids ourselves, so that callers can find out which
+    # rowids their messages ended up with even when using executemany
+    next_id, = db.execute(
+        'SELECT coalesce(max(id), 0) + 1 FROM messages').fetchone()
+    for msg in msgs:
+        msg.rowid = next_id
+        next_id += 1
+
+    db.executemany('''
+        INSERT INTO messages
+        (id, sender, class, instance, recipient, opcode, auth, time,
+         signature, body,
+         sender_lower, class_lower, instance_lower, recipient_lower,
+         class_key, instance_key)
+        VALUES (:id, :sender, :class, :instance, :recipient, :opcode,
+                :auth, :time, :signature, :body,
+                lower(:sender), lower(:class), lower(:instance),
+                lower(:recipient), thread_key(:class),
+                instance_thread_key(:instance))''',
+        (msg.to_sql() for msg in msgs))
+
+    return [msg.rowid for msg in msgs]
+
+def _ingest(db, msgs, raised):
+    rowids = _insert_messages(db, msgs)
+    _raise_undepths(db, raised)
+    return rowids
+
+def _rebuild_fulltext_index(db):
+    db.execute('''
+        INSERT INTO messages_fts (messages_fts)
+        VALUES ('rebuild')''')
+
+def _subscribe(db, class_, instance, recipient):
+    undepth, class_stripped = take_unprefix(class_)
+
+    result = db.execute('''
+        SELECT undepth, rowid
+        FROM subscriptions
+        WHERE (class = ?)
+        AND (instance = ?)
+        AND (recipient = ?)''',
+        (class_stripped, instance, recipient)).fetchone()
+
+    if result is None:
+        db.execute('''
+            INSERT INTO subscriptions
+            VALUES (?, ?, ?, ?)''',
+            (class_stripped, instance, recipient, undepth))
+        return [('un'*i + class_stripped, instance, recipient)
+                for i in range(undepth + 1)]
+    else:
+        existing_undepth, rowid = result
+        if existing_undepth < undepth:
+            db.execute('''
                 UPDATE subscriptions
-                SET undepth = max(undepth, ?)
-                WHERE class = ?''', (candidate_undepth, class_))
+                SET undepth = ?
+                WHERE rowid = ?''', (undepth, rowid))
+            return [('un'*i + class_stripped, instance, recipient)
+                    for i in range(existing_undepth + 1, undepth + 1)]
+        else:
+            return []
 
-        return affected
+def _subscribe_many(db, triples):
+    for class_, instance, recipient in triples:
+        _subscribe(db, class_, instance, recipient)
+
+def _unsubscribe(db, class_, instance, recipient):
+    undepth, _ = take_unprefix(class_)
+    if undepth != 0:
+        # cannot unsubscribe from an unclass directly
+        # TODO: clear error message
+        return []
+
+    result = db.execute('''
+        SELECT undepth, rowid
+        FROM subscriptions
+        WHERE (class = ?)
+        AND (instance = ?)
+        AND (recipient = ?)''',
+        (class_, instance, recipient)).fetchone()
+
+    if result is None:
+        return []
+
+    existing_undepth, rowid = result
+
+    db.execute('''
+        DELETE FROM subscriptions
+        WHERE rowid = ?''', (rowid, ))
+
+    return [('un'*i + class_, instance, recipient)
+            for i in range(existing_undepth + 1)]
+
+def _raise_undepths(db, raised):
+    # raised maps stripped class names to the undepth that their
+    # subscriptions should have at least. Database works out which ones
+    # these are from its SubscriptionIndex.
+    db.executemany('''
+        UPDATE subscriptions
+        SET undepth = max(undepth, ?)
+        WHERE class = ?''',
+        ((undepth, class_) for class_, undepth in raised.items()))
+
+# the functions below migrate the schema from version i to version i + 1.
+# they are run inside a transaction.
+
+def _migrate_1_to_2(db):
+    # lowercased copies of the fields that filters most often compare
+    # case-insensitively, and the thread keys (see util.thread_key and
+    # util.instance_thread_key) that RelatedFilter uses. all of these are
+    # indexed, so that filtering on them doesn't need a full table scan.
+    for column in ('sender_lower', 'class_lower', 'instance_lower',
+                   'recipient_lower', 'class_key', 'instance_key'):
+        db.execute('ALTER TABLE messages ADD COLUMN {} TEXT'.format(column))
+
+    db.execute('''
+        UPDATE messages
+        SET sender_lower = lower(sender),
+            class_lower = lower(class),
+            instance_lower = lower(instance),
+            recipient_lower = lower(recipient),
+            class_key = thread_key(class),
+            instance_key = instance_thread_key(instance)''')
+
+    _create_lowercase_indexes(db)
+
+def _create_lowercase_indexes(db):
+    db.execute('''
+        CREATE INDEX messages_sender_lower
+        ON messages (sender_lower)''')
+    db.execute('''
+        CREATE INDEX messages_class_lower
+        ON messages (class_lower)''')
+    db.execute('''
+        CREATE INDEX messages_instance_lower
+        ON messages (instance_lower)''')
+    db.execute('''
+        CREATE INDEX messages_recipient_lower
+        ON messages (recipient_lower)''')
+    db.execute('''
+        CREATE INDEX messages_class_key
+        ON messages (class_key)''')
+    db.execute('''
+        CREATE INDEX messages_thread_key
+        ON messages (class_key, instance_key)''')
+
+def _migrate_2_to_3(db):
+    # full-text index over bodies and signatures, used by the "in" operator
+    # of ParsedFilter. the text itself is only stored in the messages
+    # table, and the trigger keeps the index in sync (messages are never
+    # updated or deleted).
+    db.execute('''
+        CREATE VIRTUAL TABLE messages_fts
+        USING fts5 (body, signature, content='messages', content_rowid='id')''')
+    _create_fulltext_trigger(db)
+
+    # index the messages that are already in the database
+    _rebuild_fulltext_index(db)
+
+def _create_fulltext_trigger(db):
+    db.execute('''
+        CREATE TRIGGER messages_fts_insert
+        AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, body, signature)
+            VALUES (new.id, new.body, new.signature);
+        END''')
+
+def _migrate_3_to_4(db):
+    # times become integers (microseconds since the epoch, see
+    # util.to_epoch_us) instead of the text that the sqlite3 module makes of
+    # datetimes, so that comparing them is cheap, and they get an index for
+    # going to a given time. sqlite can't change the type of a column, so
+    # we copy the table, which also drops the indexes and the full-text
+    # trigger. the full-text index itself stays valid, since the rowids
+    # and text don't change.
+    db.create_function('timestamp_to_epoch_us', 1,
+        lambda text: to_epoch_us(datetime.fromisoformat(text))
+            if text is not None else None)
+
+    db.execute('''
+        CREATE TABLE messages_new
+        (id INTEGER PRIMARY KEY,
+         sender TEXT NOT NULL,
+         class TEXT NOT NULL,
+         instance TEXT NOT NULL,
+         recipient TEXT,
+         opcode TEXT NOT NULL,
+         auth BOOL,
+         time INTEGER,
+         signature TEXT NOT NULL,
+         body TEXT NOT NULL,
+         sender_lower TEXT,
+         class_lower TEXT,
+         instance_lower TEXT,
+         recipient_lower TEXT,
+         class_key TEXT,
+         instance_key TEXT)''')
+    db.execute('''
+        INSERT INTO messages_new
+        SELECT id, sender, class, instance, recipient, opcode, auth,
+               timestamp_to_epoch_us(time), signature, body,
+               sender_lower, class_lower, instance_lower, recipient_lower,
+               class_key, instance_key
+        FROM messages''')
+    db.execute('DROP TABLE messages')
+    db.execute('ALTER TABLE messages_new RENAME TO messages')
+
+    _create_lowercase_indexes(db)
+    _create_fulltext_trigger(db)
+    db.execute('''
+        CREATE INDEX messages_time
+        ON messages (time)''')
+
+_migrations = {
+    1: _migrate_1_to_2,
+    2: _migrate_2_to_3,
+    3: _migrate_3_to_4,
+}
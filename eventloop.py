@@ -0,0 +1,93 @@
+import os
+import selectors
+import signal
+
+# what is written to the self-pipe, and why
+WAKEUP = b'w'
+RESIZE = b'r'
+
+class EventLoop:
+    # waits for input on the terminal, for other threads to call wakeup()
+    # (when there are new zephyrgrams, or the database writer has committed
+    # something) and for the terminal to be resized.
+    # the last two are signalled through a pipe that we write to ourselves,
+    # so that we can wait for all of them at once with a selector.
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.pipe_read, self.pipe_write = os.pipe()
+        os.set_blocking(self.pipe_read, False)
+        os.set_blocking(self.pipe_write, False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.input_file, selectors.EVENT_READ, 'input')
+        self.selector.register(self.pipe_read, selectors.EVENT_READ, 'pipe')
+
+        self.resize_handler_installed = False
+        self.previous_sigwinch = None
+
+    def close(self):
+        self.uninstall_resize_handler()
+        self.selector.close()
+        os.close(self.pipe_read)
+        os.close(self.pipe_write)
+
+    def _notify(self, token):
+        try:
+            os.write(self.pipe_write, token)
+        except BlockingIOError:
+            # the pipe is full, so the main thread has plenty of tokens to
+            # wake up to already
+            pass
+
+    def wakeup(self):
+        # can be called from any thread
+        self._notify(WAKEUP)
+
+    def install_resize_handler(self):
+        # this replaces the handler installed by ncurses, so KEY_RESIZE is no
+        # longer generated, and we have to call curses.resizeterm ourselves
+        self.previous_sigwinch = signal.signal(signal.SIGWINCH,
+            lambda signum, frame: self._notify(RESIZE))
+        self.resize_handler_installed = True
+
+    def uninstall_resize_handler(self):
+        if not self.resize_handler_installed:
+            return
+
+        # signal() returns None for handlers that weren't installed from
+        # Python, such as the one of ncurses, and those can't be restored
+        signal.signal(signal.SIGWINCH,
+            self.previous_sigwinch or signal.SIG_DFL)
+        self.resize_handler_installed = False
+        self.previous_sigwinch = None
+
+    def wait(self, timeout=None):
+        # blocks until something happens, or for at most timeout seconds.
+        # returns whether there is input to read, whether wakeup() was
+        # called and whether the terminal was resized. any number of
+        # wakeups and resizes since the last call are collapsed into one.
+        input_ready = False
+        woken = False
+        resized = False
+
+        for key, _ in self.selector.select(timeout):
+            if key.data == 'input':
+                input_ready = True
+            else:
+                tokens = self._drain_pipe()
+                woken = WAKEUP in tokens
+                resized = RESIZE in tokens
+
+        return input_ready, woken, resized
+
+    def _drain_pipe(self):
+        tokens = b''
+        while True:
+            try:
+                chunk = os.read(self.pipe_read, 4096)
+            except BlockingIOError:
+                break
+            if len(chunk) == 0:
+                break
+            tokens += chunk
+        return tokens
@@ -2,6 +2,58 @@ import datetime
 
 version = 1
 
+# incoming messages are written to the database in batches of at most
+# ingest_batch_size messages. after receiving a message, wagtail waits for
+# at most ingest_max_latency seconds for more to arrive before writing it.
+ingest_batch_size = 256
+ingest_max_latency = 0.02
+
+# subscriptions (at startup, and from import_zsubs) are sent to zpipe at
+# most subscribe_chunk_size at a time, between which the UI is updated and
+# the progress shown in the status bar.
+subscribe_chunk_size = 200
+
+# if True, the database is switched to WAL mode and all writes happen on a
+# background thread, so that scrolling never has to wait for a slow commit.
+database_writer_thread = False
+
+# the screen is updated at most once every frame_interval seconds, however
+# quickly messages arrive or keys are pressed.
+frame_interval = 1 / 60
+
+# wagtail keeps latency histograms for the event handlers, drawing, the
+# database and ingestion, shown by the stats command. if stats_dump_path is
+# set, they are also written there as JSON when wagtail exits.
+collect_stats = True
+stats_dump_path = None
+
+# if profile_queries is True, every database query is timed, and the ones
+# taking at least slow_query_threshold seconds are logged with their query
+# plans (the last slow_query_log_size for each filter). the explain command
+# shows them, along with the plans of the queries for the current filter.
+profile_queries = False
+slow_query_threshold = 0.01
+slow_query_log_size = 20
+
+# style rules are tried in order for each message, and the first one whose
+# filter (in the same language as the filter command) accepts the message
+# decides its fg_color, bg_color and/or header, overriding what
+# get_zgram_display_properties returns. the colors are default, black, blue,
+# cyan, green, magenta, red, white and yellow. header templates can use the fields
+# {prefix}, {class_}, {instance}, {sender}, {recipient}, {opcode}, {auth},
+# {signature} and {time}, e.g. {time:%H:%M} ({time} is empty for messages
+# that have no time). for example:
+#     style_rules = [
+#         ('sender is "root@*"', {'fg_color': 'red'}),
+#         ('class_ is "help"', {'bg_color': 'blue',
+#             'header': '{prefix}help: {instance} / {sender}'}),
+#     ]
+style_rules = []
+
+# if True, the style of each message is decided as soon as it arrives,
+# rather than when it is first shown.
+precompute_styles = False
+
 def _pretty_print_principal(principal):
     if principal.endswith('@ATHENA.MIT.EDU'):
         return principal[:-len('@ATHENA.MIT.EDU')]
@@ -10,6 +62,11 @@ def _pretty_print_principal(principal):
 def _format_date(date):
     return date.strftime('%Y-%m-%d %H:%M')
 
+# wagtail remembers the properties returned for each message, and only asks
+# again after the config is reloaded. if yours depend on anything else (like
+# the current time), add
+#     from configmanager import uncached
+# at the top of this file and decorate the function with @uncached.
 def get_zgram_display_properties(zgram, is_current, wrap_mode):
     properties = {}
 
@@ -0,0 +1,275 @@
+# a stand-in for zpipe.ZPipe that needs no Zephyr server: it generates
+# synthetic traffic or replays a recorded stream, records the commands it is
+# given, and can make them fail. wagtail uses it when WAGTAIL_ZPIPE starts
+# with "fake", e.g.
+#   WAGTAIL_ZPIPE='fake --rate 500 --burst 20 --record /tmp/commands' \
+#       python wagtail.py
+# streams to replay are files with one JSON object per zephyrgram, with
+# the keys in STREAM_FIELDS; "python fakezpipe.py export DATABASE PATH"
+# writes one from an existing archive.
+
+import argparse
+import json
+import random
+import shlex
+import sys
+import threading
+import time
+
+from zpipe.python.zpipe import Zephyrgram as ZpipeZephyrgram
+
+from synthetic import ArchiveApp, ArchiveGenerator
+from util import get_principal
+
+STREAM_FIELDS = ('sender', 'class', 'instance', 'recipient', 'opcode', 'auth',
+    'time', 'signature', 'body')
+
+class FakeZPipeError:
+    # has the attributes of the errors that zpipe reports, and for
+    # (un)subscriptions, the (class, instance, recipient) triple that failed
+    def __init__(self, operation, message, subscription=None):
+        self.operation = operation
+        self.message = message
+        self.subscription = subscription
+
+def parse_options(args):
+    parser = argparse.ArgumentParser(prog='fake', add_help=False)
+    parser.add_argument('--rate', type=float, default=10.0,
+        help='zephyrgrams per second, on average')
+    parser.add_argument('--burst', type=float, default=1.0,
+        help='zephyrgrams per burst, on average')
+    parser.add_argument('--count', type=int, default=None,
+        help='stop after this many zephyrgrams')
+    parser.add_argument('--replay', default=None,
+        help='replay this stream instead of generating one')
+    parser.add_argument('--speed', type=float, default=1.0,
+        help='how much faster than recorded to replay (0: all at once)')
+    parser.add_argument('--record', default=None,
+        help='append the commands we get to this file')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+        help='the probability that a command fails')
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(args)
+
+def zpipe_from_record(record):
+    return ZpipeZephyrgram(sender=record['sender'],
+        cls=record['class'],
+        instance=record['instance'],
+        recipient=record['recipient'],
+        opcode=record['opcode'],
+        auth=record['auth'],
+        fields=[record['signature'], record['body']],
+        time=record['time'])
+
+def read_stream(path):
+    with open(path) as f:
+        for line in f:
+            if len(line.strip()) > 0:
+                yield json.loads(line)
+
+class FakeZPipe:
+    def __init__(self, args, zgram_handler, error_handler):
+        # args are the options after "fake", as in WAGTAIL_ZPIPE
+        self.options = parse_options(args)
+        self.zgram_handler = zgram_handler
+        self.error_handler = error_handler
+        self.rng = random.Random(self.options.seed)
+        # the traffic thread has its own, so that commands don't change
+        # the traffic that is generated
+        self.traffic_rng = random.Random(self.rng.randrange(2 ** 32))
+        self.principal = get_principal()
+
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.record_file = None
+        if self.options.record is not None:
+            self.record_file = open(self.options.record, 'a')
+
+        self.sent = 0
+        self.start_time = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        elapsed = time.monotonic() - self.start_time
+        self.record('close', sent=self.sent, elapsed=elapsed,
+            rate=self.sent / elapsed if elapsed > 0 else 0.0)
+        if self.record_file is not None:
+            self.record_file.close()
+
+    def record(self, command, **args):
+        if self.record_file is None:
+            return
+        with self.lock:
+            json.dump(dict(args, command=command, time=time.time()),
+                self.record_file)
+            self.record_file.write('\n')
+            self.record_file.flush()
+
+    def fails(self, operation, subscription=None):
+        # decides whether to inject an error into this command
+        with self.lock:
+            failed = self.rng.random() < self.options.error_rate
+        if failed:
+            self.error_handler(FakeZPipeError(operation,
+                'injected by fakezpipe', subscription))
+        return failed
+
+    def subscribe(self, class_, instance, recipient):
+        self.record('subscribe', class_=class_, instance=instance,
+            recipient=recipient)
+        if not self.fails('subscribe', (class_, instance, recipient)):
+            with self.lock:
+                self.subscriptions.add((class_, instance, recipient))
+
+    def unsubscribe(self, class_, instance, recipient):
+        self.record('unsubscribe', class_=class_, instance=instance,
+            recipient=recipient)
+        if not self.fails('unsubscribe', (class_, instance, recipient)):
+            with self.lock:
+                self.subscriptions.discard((class_, instance, recipient))
+
+    def is_subscribed(self, zgram):
+        with self.lock:
+            return any((class_ == zgram.cls) and
+                (instance in ('*', zgram.instance)) and
+                (recipient in ('*', '', zgram.recipient))
+                for class_, instance, recipient in self.subscriptions)
+
+    def zwrite(self, zgram):
+        self.record('zwrite', class_=zgram.cls, instance=zgram.instance,
+            recipient=zgram.recipient, opcode=zgram.opcode,
+            fields=zgram.fields)
+        if self.fails('zwrite'):
+            return
+
+        # like Zephyr, send it back to us if we are subscribed to it
+        echo = ZpipeZephyrgram(sender=zgram.sender or self.principal,
+            cls=zgram.cls,
+            instance=zgram.instance,
+            recipient=zgram.recipient or '*',
+            opcode=zgram.opcode,
+            auth=True,
+            fields=zgram.fields,
+            time=time.time())
+        if (echo.cls.lower() != 'message') and self.is_subscribed(echo):
+            self.deliver(echo)
+
+    def deliver(self, zgram):
+        with self.lock:
+            self.sent += 1
+        self.zgram_handler(self, zgram)
+
+    def run(self):
+        if self.options.replay is not None:
+            self.replay()
+        else:
+            self.generate()
+
+    def sleep(self, seconds):
+        # returns whether we should stop
+        return self.stopped.wait(seconds) if seconds > 0 \
+            else self.stopped.is_set()
+
+    def generate(self):
+        # bursts come at random (exponentially distributed) intervals, and
+        # their sizes are geometrically distributed with the given mean, so
+        # that we send options.rate zephyrgrams per second on average.
+        rng = self.traffic_rng
+        generator = ArchiveGenerator(seed=rng.randrange(2 ** 32))
+        count = self.options.count
+        mean_burst = max(1.0, self.options.burst)
+
+        while (count is None) or (self.sent < count):
+            burst = 1
+            while rng.random() > 1 / mean_burst:
+                burst += 1
+            if count is not None:
+                burst = min(burst, count - self.sent)
+
+            for i in range(burst):
+                zgram = generator.message().to_zpipe()
+                zgram.time = time.time()
+                self.deliver(zgram)
+
+            if self.sleep(rng.expovariate(self.options.rate / burst)):
+                return
+
+    def replay(self):
+        # keeps the intervals between the recorded zephyrgrams (divided by
+        # options.speed), but not their times
+        previous = None
+        for record in read_stream(self.options.replay):
+            if (self.options.count is not None) and \
+               (self.sent >= self.options.count):
+                return
+
+            # zephyrgrams without a time are sent right after the previous one
+            if (previous is not None) and (record['time'] is not None) and \
+               (self.options.speed > 0):
+                if self.sleep((record['time'] - previous) /
+                              self.options.speed):
+                    return
+            elif self.stopped.is_set():
+                return
+            if record['time'] is not None:
+                previous = record['time']
+
+            zgram = zpipe_from_record(record)
+            zgram.time = time.time()
+            self.deliver(zgram)
+
+def make_zpipe(command, zgram_handler, error_handler):
+    # command is WAGTAIL_ZPIPE: the command line of zpipe, or "fake"
+    # followed by options for FakeZPipe
+    args = shlex.split(command)
+    if args[:1] == ['fake']:
+        return FakeZPipe(args[1:], zgram_handler, error_handler)
+
+    from zpipe.python import zpipe
+    return zpipe.ZPipe(args, zgram_handler, error_handler)
+
+def export_stream(database_path, path, limit=None):
+    # writes the messages in an archive as a stream that can be replayed
+    from db import Database
+
+    with Database(ArchiveApp(database_path)) as db, open(path, 'w') as f:
+        index = db.first_index()
+        written = 0
+        while (index is not None) and ((limit is None) or (written < limit)):
+            batch = list(db.get_messages_starting_with(index, limit=1000))
+            if len(batch) == 0:
+                break
+            for message in batch:
+                record = message.to_sql()
+                record['class'] = message.class_
+                record['time'] = message.time.timestamp() \
+                    if message.time is not None else None
+                json.dump({k: record[k] for k in STREAM_FIELDS}, f)
+                f.write('\n')
+                written += 1
+                if written == limit:
+                    break
+            index = batch[-1].rowid + 1
+
+def main():
+    parser = argparse.ArgumentParser(description=
+        'Tools for the fake zpipe.')
+    subparsers = parser.add_subparsers(dest='command')
+    export = subparsers.add_parser('export',
+        help='write the messages in an archive as a stream to replay')
+    export.add_argument('database')
+    export.add_argument('path')
+    export.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_stream(args.database, args.path, args.limit)
+    else:
+        parser.print_usage(file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
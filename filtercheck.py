@@ -0,0 +1,183 @@
+# differential test harness for filters: checks that Filter.matches() agrees
+# with the filter's SQL on randomly generated messages and filters.
+# run it as "python filtercheck.py"; it exits with status 1 on disagreement.
+
+import argparse
+import random
+import sys
+
+from datetime import datetime, timedelta
+
+from db import Database
+from filterexpr import to_sql
+from filtering import (ParsedFilter, RelatedFilter, NegationFilter,
+    ConjunctionFilter, NopFilterSingleton)
+from zephyrgram import Zephyrgram
+
+PRINCIPAL = 'me@ATHENA.MIT.EDU'
+
+CLASSES = ['message', 'MESSAGE', 'help', 'unhelp', 'ununHelp', 'help.d',
+    'Sipb', 'sipb.d.d', 'un', '[x]', 'a*b']
+INSTANCES = ['personal', 'urgent', 'foo', 'Foo.d', 'unfoo', 'bar?', '',
+    '0', '12abc']
+PRINCIPALS = [PRINCIPAL, 'alice@ATHENA.MIT.EDU', 'Bob@ATHENA.MIT.EDU',
+    'bob@athena.mit.edu', 'ÉLAN@ATHENA.MIT.EDU', '*']
+WORDS = ['hello', 'Hello,', 'world', 'wörld', 'quick-brown', 'fox', 'x',
+    '42', '0', ' 3', '.5e1x', 'foo*bar', '[a-c]', '"quoted"', '']
+OPCODES = ['', 'auto', 'PING', '1']
+
+FIELDS = ['class_', 'cla', 'instance', 'ins', 'recipient', 'rec', 'sender',
+    'sen', 'opcode', 'opc', 'signature', 'sig', 'body', 'bod', 'time']
+COMPARISONS = ['==', '!=', '<', '<=', '>', '>=', 'is', 'is not']
+
+class App:
+    principal = PRINCIPAL
+
+    def get_database_path(self):
+        return ':memory:'
+
+def random_message(rng):
+    class_ = rng.choice(CLASSES)
+    if class_.lower() == 'message':
+        recipient = rng.choice(PRINCIPALS + [None])
+    else:
+        recipient = rng.choice(['*', '', PRINCIPAL, None])
+
+    return Zephyrgram(rowid=None,
+        sender=rng.choice(PRINCIPALS),
+        class_=class_,
+        instance=rng.choice(INSTANCES),
+        recipient=recipient,
+        opcode=rng.choice(OPCODES),
+        auth=rng.choice([True, False]),
+        time=rng.choice([None, datetime.now() - timedelta(
+            hours=rng.uniform(0, 72))]),
+        signature=' '.join(rng.choice(WORDS) for i in range(rng.randrange(3))),
+        body='\n'.join(' '.join(rng.choice(WORDS)
+                for i in range(rng.randrange(6)))
+            for j in range(rng.randrange(1, 3))))
+
+def quote(s):
+    return '"{}"'.format(s.replace('\\', '\\\\').replace('"', '\\"'))
+
+def random_pattern(rng):
+    pattern = list(rng.choice(CLASSES + INSTANCES + PRINCIPALS + WORDS))
+    for i in range(rng.randrange(3)):
+        pattern.insert(rng.randrange(len(pattern) + 1),
+            rng.choice(['*', '?', '[a-z]', '[^x]', '[]', '[z-a]', 'A']))
+    return ''.join(pattern)
+
+def random_time(rng):
+    return rng.choice(['now', 'today', 'yesterday',
+        '{} ago'.format(rng.choice(['30m', '2h', '1 day', '50 hours'])),
+        (datetime.now() - timedelta(hours=rng.uniform(0, 72))).isoformat(' '),
+        (datetime.now() - timedelta(days=rng.randrange(3))).date().isoformat(),
+        ])
+
+def random_atom(rng):
+    kind = rng.randrange(8)
+    if kind == 0:
+        return rng.choice(FIELDS)
+    elif kind == 1:
+        return str(rng.choice([0, 1, 3, 42, 1.5, 1e20]))
+    elif kind == 2:
+        return '{} {} {}'.format(rng.choice(FIELDS), rng.choice(COMPARISONS),
+            rng.choice(FIELDS))
+    elif kind == 3:
+        return '{} {} {}'.format(rng.choice(FIELDS), rng.choice(COMPARISONS),
+            rng.choice(['0', '3', '42', '1.5']))
+    elif kind == 4:
+        return '{} in {}'.format(
+            quote(' '.join(rng.choice(WORDS) + rng.choice(['', '*'])
+                for i in range(rng.randrange(1, 3)))),
+            rng.choice(['body', 'signature']))
+    elif kind == 5:
+        if rng.random() < 0.3:
+            return 'time {} {}'.format(rng.choice(['is', 'is not']),
+                quote(rng.choice(['last 3h', 'last 2 days', random_time(rng)])))
+        return 'time {} {}'.format(rng.choice(COMPARISONS[:6]),
+            quote(random_time(rng)))
+    else:
+        return '{} {} {}'.format(rng.choice(FIELDS), rng.choice(COMPARISONS),
+            quote(random_pattern(rng)))
+
+def random_code(rng, depth=0):
+    kind = rng.randrange(6) if depth < 3 else 0
+    if kind <= 1:
+        return random_atom(rng)
+    elif kind == 2:
+        return 'not ({})'.format(random_code(rng, depth + 1))
+    elif kind == 5:
+        # the value of a logical expression, rather than its truth
+        return '({}) {} ({})'.format(random_code(rng, depth + 1),
+            rng.choice(COMPARISONS), random_code(rng, depth + 1))
+    else:
+        return '({}) {} ({})'.format(random_code(rng, depth + 1),
+            'and' if kind == 3 else 'or', random_code(rng, depth + 1))
+
+def random_filter(rng, app, messages, depth=0):
+    kind = rng.randrange(6) if depth < 2 else rng.randrange(3)
+    if kind == 0:
+        while True:
+            try:
+                return ParsedFilter(random_code(rng))
+            except SyntaxError:
+                pass
+    elif kind == 1:
+        return RelatedFilter(app, rng.choice(messages),
+            class_only=rng.choice([True, False]))
+    elif kind == 2:
+        return NopFilterSingleton
+    elif kind == 3:
+        return NegationFilter(random_filter(rng, app, messages, depth + 1))
+    else:
+        return ConjunctionFilter(random_filter(rng, app, messages, depth + 1),
+            random_filter(rng, app, messages, depth + 1))
+
+def main():
+    parser = argparse.ArgumentParser(description=
+        'Check that filters give the same results in SQL and in Python.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--filters', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    app = App()
+
+    with Database(app) as db:
+        messages = [random_message(rng) for i in range(args.messages)]
+        db.append_messages(messages)
+
+        failures = 0
+        for i in range(args.filters):
+            filter = random_filter(rng, app, messages)
+            sql_result = {row[0] for row in db.execute_filtered(
+                'SELECT id FROM messages WHERE {}', filter)}
+            python_result = {message.rowid for message in messages
+                if filter.matches(message)}
+
+            # the optimizer must not change what the filter selects
+            source_sql, source_params = to_sql(filter.source_expr)
+            source_result = {row[0] for row in db.db.execute(
+                'SELECT id FROM messages WHERE {}'.format(source_sql),
+                source_params)}
+
+            if not (sql_result == python_result == source_result):
+                failures += 1
+                print('MISMATCH for filter {}'.format(filter.name()))
+                print('  SQL: {}'.format(filter.to_sql()))
+                print('  unoptimized SQL: {}'.format(source_sql))
+                for rowid in sorted((sql_result ^ python_result) |
+                                    (sql_result ^ source_result))[:5]:
+                    print('  message {}: SQL says {}, Python says {}, '
+                        'unoptimized SQL says {}'.format(rowid,
+                            rowid in sql_result, rowid in python_result,
+                            rowid in source_result))
+
+    print('{} filters checked on {} messages, {} mismatches'.format(
+        args.filters, args.messages, failures))
+    sys.exit(1 if failures > 0 else 0)
+
+if __name__ == '__main__':
+    main()
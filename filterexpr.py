@@ -0,0 +1,587 @@
+import functools
+import math
+import operator
+import re
+import unicodedata
+
+from util import ascii_lower, instance_thread_key, thread_key, to_epoch_us
+
+def fulltext_query(text, columns):
+    # turns a string of words into an FTS5 query that matches text
+    # containing all of these words in any of the given columns. a word
+    # ending with * matches any word that it is a prefix of.
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if len(word) > 0:
+            terms.append('"{}"{}'.format(word.replace('"', '""'),
+                '*' if prefix else ''))
+
+    if len(terms) == 0:
+        raise SyntaxError('full-text search needs at least one word')
+
+    return '{{{}}} : ({})'.format(' '.join(columns), ' '.join(terms))
+
+# the functions below implement SQLite's semantics for values, so that
+# filters can be evaluated on messages in Python, with exactly the same
+# results as their SQL. NULL is represented by None, and the results of
+# logical operations by True, False or None.
+
+def _sql_text(value):
+    # converts a value to TEXT, the way SQLite does
+    if isinstance(value, float):
+        text = '%.15g' % value
+        mantissa, e, exponent = text.partition('e')
+        if ('.' not in mantissa) and mantissa.lstrip('-').isdigit():
+            mantissa += '.0'
+        return mantissa + e + exponent
+    if isinstance(value, int):
+        return str(int(value))
+    return value
+
+_numeric_literal = re.compile(
+    r'\s*[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?\s*')
+
+def _sql_numeric(value):
+    # applies NUMERIC affinity to a value, the way SQLite does: TEXT that
+    # is a well-formed number becomes that number
+    if isinstance(value, str):
+        match = _numeric_literal.fullmatch(value)
+        if match is not None:
+            if (match.group(2) is None) and (match.group(3) is None):
+                number = int(value)
+                # integers that don't fit in 64 bits become REAL
+                if -2 ** 63 <= number < 2 ** 63:
+                    return number
+            return float(value)
+    return value
+
+_numeric_prefix = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+
+def sql_truth(value):
+    # SQLite treats TEXT used as a boolean as the number it starts with
+    if value is None:
+        return None
+    if isinstance(value, str):
+        match = _numeric_prefix.match(value)
+        return (match is not None) and (float(match.group(0)) != 0)
+    return value != 0
+
+def _sql_not(value):
+    value = sql_truth(value)
+    return None if value is None else not value
+
+def _sql_and(values):
+    result = True
+    for value in values:
+        value = sql_truth(value)
+        if value is False:
+            return False
+        elif value is None:
+            result = None
+    return result
+
+def _sql_or(values):
+    result = False
+    for value in values:
+        value = sql_truth(value)
+        if value is True:
+            return True
+        elif value is None:
+            result = None
+    return result
+
+def _sql_compare(op, left, right):
+    if (left is None) or (right is None):
+        return None
+
+    # numbers are less than TEXT values
+    left_rank = isinstance(left, str)
+    right_rank = isinstance(right, str)
+    if left_rank != right_rank:
+        return op(left_rank, right_rank)
+    return op(left, right)
+
+@functools.lru_cache(maxsize=256)
+def _glob_to_regex(pattern):
+    # translates an SQLite GLOB pattern into a regular expression
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            regex.append('.*')
+        elif c == '?':
+            regex.append('.')
+        elif c == '[':
+            invert = False
+            members = []
+            if (i < len(pattern)) and (pattern[i] == '^'):
+                invert = True
+                i += 1
+            if (i < len(pattern)) and (pattern[i] == ']'):
+                members.append(re.escape(']'))
+                i += 1
+            prior = None
+            while (i < len(pattern)) and (pattern[i] != ']'):
+                c = pattern[i]
+                if ((c == '-') and (prior is not None) and
+                    (i + 1 < len(pattern)) and (pattern[i + 1] != ']')):
+                    if prior <= pattern[i + 1]:
+                        members[-1] = '{}-{}'.format(re.escape(prior),
+                            re.escape(pattern[i + 1]))
+                    else:
+                        # an empty range
+                        del members[-1]
+                    prior = None
+                    i += 2
+                else:
+                    members.append(re.escape(c))
+                    prior = c
+                    i += 1
+
+            if i == len(pattern):
+                # SQLite never matches a pattern with an unterminated set
+                return re.compile('(?!)')
+            i += 1
+
+            if len(members) == 0:
+                # only possible with empty ranges, like [z-a]
+                regex.append('(?!)' if not invert else '.')
+            else:
+                regex.append('[{}{}]'.format('^' if invert else '',
+                    ''.join(members)))
+        else:
+            regex.append(re.escape(c))
+
+    return re.compile(''.join(regex), re.DOTALL)
+
+def _sql_glob(pattern, value):
+    if (pattern is None) or (value is None):
+        return None
+    return _glob_to_regex(_sql_text(pattern)).fullmatch(_sql_text(value)) \
+        is not None
+
+def _sql_lower(value):
+    if value is None:
+        return None
+    return ascii_lower(_sql_text(value))
+
+def _fulltext_tokens(text):
+    # splits text into tokens the way FTS5's default unicode61 tokenizer
+    # does: letters, numbers and private use characters make up tokens,
+    # which are case-folded and stripped of diacritics
+    tokens = []
+    token = []
+    for c in unicodedata.normalize('NFD', text):
+        category = unicodedata.category(c)
+        if category.startswith('M'):
+            continue
+        if (category[0] in 'LN') or (category == 'Co'):
+            token.append(c.lower())
+        elif len(token) > 0:
+            tokens.append(''.join(token))
+            token = []
+    if len(token) > 0:
+        tokens.append(''.join(token))
+    return tokens
+
+def _fulltext_phrases(text):
+    # the Python counterpart of fulltext_query: a list of phrases (lists of
+    # tokens), and whether the last token of each is a prefix
+    phrases = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        tokens = _fulltext_tokens(word.rstrip('*'))
+        if len(tokens) > 0:
+            phrases.append((tokens, prefix))
+    return phrases
+
+def _fulltext_matches(phrases, text):
+    tokens = _fulltext_tokens(text)
+    for phrase, prefix in phrases:
+        n = len(phrase)
+        for start in range(len(tokens) - n + 1):
+            candidate = tokens[start:start + n]
+            if (candidate[:-1] == phrase[:-1]) and \
+               (candidate[-1].startswith(phrase[-1]) if prefix
+                else candidate[-1] == phrase[-1]):
+                break
+        else:
+            return False
+    return True
+
+# filters are represented as trees of the nodes below. every filter goes
+# through optimize() before being turned into SQL (with to_sql) and into a
+# Python predicate (with to_predicate), so that they are always equivalent.
+
+class Expr:
+    __slots__ = ()
+
+    def key(self):
+        assert False, 'abstract'
+
+    def __eq__(self, other):
+        return (type(self) is type(other)) and (self.key() == other.key())
+
+    def __hash__(self):
+        return hash((type(self), self.key()))
+
+    def __repr__(self):
+        return '{}{!r}'.format(type(self).__name__, self.key())
+
+class Literal(Expr):
+    __slots__ = ('value', )
+
+    def __init__(self, value):
+        self.value = value
+
+    def key(self):
+        # 1 and 1.0 (and True) are different literals as far as SQL goes
+        return (type(self.value), self.value)
+
+class Column(Expr):
+    __slots__ = ('name', )
+
+    def __init__(self, name):
+        self.name = name
+
+    def key(self):
+        return self.name
+
+class Lower(Expr):
+    __slots__ = ('operand', )
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def key(self):
+        return self.operand
+
+class Not(Expr):
+    __slots__ = ('operand', )
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def key(self):
+        return self.operand
+
+class And(Expr):
+    __slots__ = ('operands', )
+
+    def __init__(self, operands):
+        self.operands = tuple(operands)
+
+    def key(self):
+        return self.operands
+
+class Or(Expr):
+    __slots__ = ('operands', )
+
+    def __init__(self, operands):
+        self.operands = tuple(operands)
+
+    def key(self):
+        return self.operands
+
+class Compare(Expr):
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def key(self):
+        return (self.op, self.left, self.right)
+
+class Glob(Expr):
+    # value GLOB pattern
+    __slots__ = ('value', 'pattern')
+
+    def __init__(self, value, pattern):
+        self.value = value
+        self.pattern = pattern
+
+    def key(self):
+        return (self.value, self.pattern)
+
+class FullText(Expr):
+    # whether the column contains all the words of text, using the full-text
+    # index
+    __slots__ = ('column', 'text')
+
+    def __init__(self, column, text):
+        self.column = column
+        self.text = text
+
+    def key(self):
+        return (self.column, self.text)
+
+TRUE = Literal(1)
+FALSE = Literal(0)
+
+# how each column is computed from a Zephyrgram. the columns after the
+# first seven are derived ones, filled in when messages are inserted.
+_column_values = {
+    'class': operator.attrgetter('class_'),
+    'instance': operator.attrgetter('instance'),
+    'recipient': operator.attrgetter('recipient'),
+    'sender': operator.attrgetter('sender'),
+    'opcode': operator.attrgetter('opcode'),
+    'signature': operator.attrgetter('signature'),
+    'body': operator.attrgetter('body'),
+    'class_lower': lambda message: _sql_lower(message.class_),
+    'instance_lower': lambda message: _sql_lower(message.instance),
+    'recipient_lower': lambda message: _sql_lower(message.recipient),
+    'sender_lower': lambda message: _sql_lower(message.sender),
+    'class_key': lambda message: thread_key(message.class_),
+    'instance_key': lambda message: instance_thread_key(message.instance),
+    'time': lambda message: to_epoch_us(message.time),
+}
+
+# columns with INTEGER affinity. all the others have TEXT affinity.
+INTEGER_COLUMNS = {'time'}
+
+# columns for which the messages table has an indexed lowercased copy
+LOWER_COLUMNS = {
+    'class': 'class_lower',
+    'instance': 'instance_lower',
+    'recipient': 'recipient_lower',
+    'sender': 'sender_lower',
+}
+
+_comparison_ops = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+_negated_comparisons = {
+    '=': '!=',
+    '!=': '=',
+    '<': '>=',
+    '>=': '<',
+    '>': '<=',
+    '<=': '>',
+}
+
+_glob_wildcards = re.compile(r'[*?\[]')
+
+def _is_text(expr):
+    # whether the value of expr is always TEXT (or NULL). this is true for
+    # columns with TEXT affinity, since they are only ever given strings.
+    return (isinstance(expr, Column) and
+            (expr.name not in INTEGER_COLUMNS)) or \
+        isinstance(expr, Lower) or \
+        (isinstance(expr, Literal) and isinstance(expr.value, str))
+
+def optimize(expr, boolean=True):
+    # returns a simpler expression equivalent to expr. when boolean is true,
+    # only the truth value of the result matters (e.g. in a WHERE clause or
+    # under AND, OR and NOT), which allows some more simplifications.
+    if isinstance(expr, (Literal, Column, FullText)):
+        return expr
+    elif isinstance(expr, Lower):
+        operand = optimize(expr.operand, False)
+        if isinstance(operand, Literal):
+            return Literal(_sql_lower(operand.value))
+        if isinstance(operand, Lower):
+            return operand
+        return Lower(operand)
+    elif isinstance(expr, Not):
+        operand = optimize(expr.operand, True)
+        if isinstance(operand, Literal):
+            value = _sql_not(operand.value)
+            return Literal(None if value is None else int(value))
+        if isinstance(operand, Compare):
+            return Compare(_negated_comparisons[operand.op], operand.left,
+                operand.right)
+        if isinstance(operand, Not) and boolean:
+            return operand.operand
+        return Not(operand)
+    elif isinstance(expr, (And, Or)):
+        return _optimize_connective(expr, boolean)
+    elif isinstance(expr, Compare):
+        return Compare(expr.op, optimize(expr.left, False),
+            optimize(expr.right, False))
+    elif isinstance(expr, Glob):
+        value = _lower_column(optimize(expr.value, False))
+        pattern = _lower_column(optimize(expr.pattern, False))
+
+        # a pattern without wildcards only matches itself, and unlike GLOB,
+        # = can use an index on any column. this is only the same when the
+        # value is TEXT, since GLOB would convert a number to TEXT first.
+        if isinstance(pattern, Literal) and isinstance(pattern.value, str) \
+           and (_glob_wildcards.search(pattern.value) is None) \
+           and _is_text(value):
+            return Compare('=', value, pattern)
+        return Glob(value, pattern)
+    else:
+        raise TypeError('unknown expression {!r}'.format(expr))
+
+def _lower_column(expr):
+    # lower(column) can use the indexed lowercased copy of the column. this
+    # is only safe where affinity doesn't matter, since lower() has none.
+    if isinstance(expr, Lower) and isinstance(expr.operand, Column) and \
+       (expr.operand.name in LOWER_COLUMNS):
+        return Column(LOWER_COLUMNS[expr.operand.name])
+    return expr
+
+def _optimize_connective(expr, boolean):
+    is_and = isinstance(expr, And)
+    absorbing = False if is_and else True
+
+    operands = []
+    seen = set()
+    for operand in expr.operands:
+        operand = optimize(operand, True)
+        # (a AND b) AND c is a AND b AND c
+        nested = operand.operands if type(operand) is type(expr) \
+            else (operand, )
+        for operand in nested:
+            if isinstance(operand, Literal):
+                truth = sql_truth(operand.value)
+                if truth is absorbing:
+                    return Literal(int(absorbing))
+                if truth is not None:
+                    # TRUE in an AND or FALSE in an OR changes nothing
+                    continue
+                operand = Literal(None)
+            if operand not in seen:
+                seen.add(operand)
+                operands.append(operand)
+
+    if len(operands) == 0:
+        return Literal(int(not absorbing))
+    if (len(operands) == 1) and boolean:
+        return operands[0]
+    if len(operands) == 1:
+        # the result of AND and OR is always 0, 1 or NULL, so the operand
+        # can't stand on its own when its value is used
+        operands.append(Literal(int(not absorbing)))
+    return And(operands) if is_and else Or(operands)
+
+def to_sql(expr):
+    # returns SQL for the expression, and the values of its ? placeholders
+    params = []
+    sql = _to_sql(expr, params)
+    return sql, tuple(params)
+
+def _to_sql(expr, params):
+    if isinstance(expr, Literal):
+        if isinstance(expr.value, bool):
+            return str(int(expr.value))
+        # non-finite floats (like 1e999) have no literal syntax in SQL, so
+        # they are bound like strings
+        if isinstance(expr.value, int) or \
+           (isinstance(expr.value, float) and math.isfinite(expr.value)):
+            return str(expr.value)
+        params.append(expr.value)
+        return '?'
+    elif isinstance(expr, Column):
+        return expr.name
+    elif isinstance(expr, Lower):
+        return 'lower({})'.format(_to_sql(expr.operand, params))
+    elif isinstance(expr, Not):
+        return 'NOT ({})'.format(_to_sql(expr.operand, params))
+    elif isinstance(expr, (And, Or)):
+        op = ' AND ' if isinstance(expr, And) else ' OR '
+        return op.join('({})'.format(_to_sql(x, params))
+            for x in expr.operands)
+    elif isinstance(expr, Compare):
+        return '({}) {} ({})'.format(_to_sql(expr.left, params), expr.op,
+            _to_sql(expr.right, params))
+    elif isinstance(expr, Glob):
+        return '({}) GLOB ({})'.format(_to_sql(expr.value, params),
+            _to_sql(expr.pattern, params))
+    elif isinstance(expr, FullText):
+        params.append(fulltext_query(expr.text, (expr.column, )))
+        return ('id IN (SELECT rowid FROM messages_fts '
+                'WHERE messages_fts MATCH ?)')
+    else:
+        raise TypeError('unknown expression {!r}'.format(expr))
+
+def to_predicate(expr):
+    # returns a function computing the value of the expression for a message,
+    # the same way SQLite would
+    predicate, _ = _to_predicate(expr)
+    return predicate
+
+def _to_predicate(expr):
+    # also returns the affinity of the expression, which only columns have:
+    # 'TEXT', 'INTEGER' or None
+    if isinstance(expr, Literal):
+        value = expr.value
+        return (lambda message: value), None
+    elif isinstance(expr, Column):
+        return _column_values[expr.name], \
+            'INTEGER' if expr.name in INTEGER_COLUMNS else 'TEXT'
+    elif isinstance(expr, Lower):
+        operand, _ = _to_predicate(expr.operand)
+        return (lambda message: _sql_lower(operand(message))), None
+    elif isinstance(expr, Not):
+        operand, _ = _to_predicate(expr.operand)
+        return (lambda message: _sql_not(operand(message))), None
+    elif isinstance(expr, (And, Or)):
+        values = [_to_predicate(x)[0] for x in expr.operands]
+        combine = _sql_and if isinstance(expr, And) else _sql_or
+        return (lambda message:
+            combine(value(message) for value in values)), None
+    elif isinstance(expr, Compare):
+        op = _comparison_ops[expr.op]
+        left, left_affinity = _to_predicate(expr.left)
+        right, right_affinity = _to_predicate(expr.right)
+
+        # if one side has INTEGER affinity, the other side is converted to a
+        # number if it can be. otherwise, if exactly one side has TEXT
+        # affinity, the other side is converted to TEXT.
+        if 'INTEGER' in (left_affinity, right_affinity):
+            if left_affinity != 'INTEGER':
+                left = _numeric_predicate(left)
+            if right_affinity != 'INTEGER':
+                right = _numeric_predicate(right)
+        elif (left_affinity == 'TEXT') and (right_affinity is None):
+            right = _text_predicate(right)
+        elif (right_affinity == 'TEXT') and (left_affinity is None):
+            left = _text_predicate(left)
+
+        return (lambda message:
+            _sql_compare(op, left(message), right(message))), None
+    elif isinstance(expr, Glob):
+        value, _ = _to_predicate(expr.value)
+        if isinstance(expr.pattern, Literal):
+            if expr.pattern.value is None:
+                return (lambda message: None), None
+
+            # compile the pattern just once
+            regex = _glob_to_regex(_sql_text(expr.pattern.value))
+            def glob(message):
+                text = value(message)
+                if text is None:
+                    return None
+                return regex.fullmatch(_sql_text(text)) is not None
+            return glob, None
+
+        pattern, _ = _to_predicate(expr.pattern)
+        return (lambda message:
+            _sql_glob(pattern(message), value(message))), None
+    elif isinstance(expr, FullText):
+        column = _column_values[expr.column]
+        phrases = _fulltext_phrases(expr.text)
+        return (lambda message:
+            _fulltext_matches(phrases, column(message))), None
+    else:
+        raise TypeError('unknown expression {!r}'.format(expr))
+
+def _text_predicate(predicate):
+    return lambda message: _sql_text(predicate(message))
+
+def _numeric_predicate(predicate):
+    return lambda message: _sql_numeric(predicate(message))
@@ -1,120 +1,194 @@
 import ast
-import sqlite3
 
-# unfortunately, the only way to quote a literal using the Python SQLite
-# bindings is to do a "SELECT quote(?)" query.
-_sqlite_tmp = sqlite3.connect(':memory:')
-
-def sqlite_quote(s, lower=False):
-    if lower:
-        return _sqlite_tmp.execute('SELECT quote(lower(?))', (s, )).fetchone()[0]
-    else:
-        return _sqlite_tmp.execute('SELECT quote(?)', (s, )).fetchone()[0]
+from filterexpr import (Literal, Column, Lower, Not, And, Or, Compare, Glob,
+    FullText, fulltext_query, optimize, sql_truth, to_predicate, to_sql)
+from util import (ascii_lower, instance_thread_key, parse_period,
+    parse_time, thread_key, to_epoch_us)
 
 class Filter:
+    # filters are built from an expression tree (see filterexpr), which is
+    # optimized and then compiled both to SQL and to a Python predicate.
+    # the SQL has ? placeholders for literals, whose values are given by
+    # sql_params(). the SQL of a filter never changes, so queries using it
+    # can be prepared once and reused.
+    def __init__(self, expr):
+        # filters combining other filters are built from their unoptimized
+        # trees, so that the whole tree is optimized at once
+        self.source_expr = expr
+        self.expr = optimize(expr)
+        self.sql, self.params = to_sql(self.expr)
+        self.predicate = to_predicate(self.expr)
+
     def to_sql(self):
-        assert False, 'abstract'
+        return self.sql
+
+    def sql_params(self):
+        return self.params
+
+    def matches(self, message):
+        # whether the message is accepted by the filter, i.e. whether its SQL
+        # in a WHERE clause would select it
+        return sql_truth(self.predicate(message)) is True
 
     def name(self):
         assert False, 'abstract'
 
+_field_map = {
+    'class_': 'class',
+    'cla': 'class',
+    'instance': 'instance',
+    'ins': 'instance',
+    'recipient': 'recipient',
+    'rec': 'recipient',
+    'sender': 'sender',
+    'sen': 'sender',
+    'opcode': 'opcode',
+    'opc': 'opcode',
+    'signature': 'signature',
+    'sig': 'signature',
+    'body': 'body',
+    'bod': 'body',
+    'time': 'time',
+}
+
+_comparison_ops = {
+    ast.Eq: '=',
+    ast.NotEq: '!=',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Gt: '>',
+    ast.GtE: '>=',
+}
+
+# a < b is b > a, and so on
+_flipped_comparisons = {
+    ast.Eq: ast.Eq,
+    ast.NotEq: ast.NotEq,
+    ast.Lt: ast.Gt,
+    ast.LtE: ast.GtE,
+    ast.Gt: ast.Lt,
+    ast.GtE: ast.LtE,
+}
+
 class ParsedFilter(Filter):
     def __init__(self, code):
         self.code = code
         self.tree = ast.parse(code, mode='eval')
+        super().__init__(self._to_expr(self.tree))
 
-        self.sql = self._to_sql(self.tree)
-
-    def _to_sql(self, root):
+    def _to_expr(self, root):
         if isinstance(root, ast.Expression):
-            return self._to_sql(root.body)
+            return self._to_expr(root.body)
         elif isinstance(root, ast.Num):
-            return str(root.n)
+            return Literal(root.n)
         elif isinstance(root, ast.Str):
-            return sqlite_quote(root.s)
+            return Literal(root.s)
         elif isinstance(root, ast.Name):
             # because we're parsing with mode='eval', we can't be assigning
             # a value to a variable or deleting it
             assert isinstance(root.ctx, ast.Load)
 
-            field_map = {
-                'class_': 'class',
-                'cla': 'class',
-                'instance': 'instance',
-                'ins': 'instance',
-                'recipient': 'recipient',
-                'rec': 'recipient',
-                'sender': 'sender',
-                'sen': 'sender',
-                'opcode': 'opcode',
-                'opc': 'opcode',
-                'signature': 'signature',
-                'sig': 'signature',
-                'body': 'body',
-                'bod': 'body'
-            }
-
-            if root.id not in field_map:
+            if root.id not in _field_map:
                 raise SyntaxError('unknown field {}'.format(root.id))
 
-            return field_map[root.id]
+            return Column(_field_map[root.id])
         elif isinstance(root, ast.UnaryOp):
             if not isinstance(root.op, ast.Not):
                 raise SyntaxError('invalid unary operator')
 
-            return 'NOT ({})'.format(self._to_sql(root.operand))
+            return Not(self._to_expr(root.operand))
         elif isinstance(root, ast.BoolOp):
             assert isinstance(root.op, ast.Or) or isinstance(root.op, ast.And)
-            op = ' AND ' if isinstance(root.op, ast.And) else ' OR '
-            return op.join('({})'.format(self._to_sql(x)) for x in root.values)
+            connective = And if isinstance(root.op, ast.And) else Or
+            return connective(self._to_expr(x) for x in root.values)
         elif isinstance(root, ast.Compare):
             if len(root.ops) != 1:
                 raise SyntaxError('multiple comparisons are not supported')
 
-            op = ''
-            # we need special handling for GLOB and NOT GLOB to make them
-            # case-insensitive
-            lower = False
-            if isinstance(root.ops[0], ast.Eq):
-                op = '='
-            elif isinstance(root.ops[0], ast.NotEq):
-                op = '!='
-            elif isinstance(root.ops[0], ast.Lt):
-                op = '<'
-            elif isinstance(root.ops[0], ast.LtE):
-                op = '<='
-            elif isinstance(root.ops[0], ast.Gt):
-                op = '>'
-            elif isinstance(root.ops[0], ast.GtE):
-                op = '>='
-            elif isinstance(root.ops[0], ast.Is):
-                op = 'GLOB'
-                lower = True
-            elif isinstance(root.ops[0], ast.IsNot):
-                op = 'NOT GLOB'
-                lower = True
+            op = root.ops[0]
+            if isinstance(op, (ast.In, ast.NotIn)):
+                return self._fulltext_to_expr(root)
+
+            time_expr = self._time_to_expr(root)
+            if time_expr is not None:
+                return time_expr
+
+            left = self._to_expr(root.left)
+            right = self._to_expr(root.comparators[0])
+            if type(op) in _comparison_ops:
+                return Compare(_comparison_ops[type(op)], left, right)
+            # is and is not are case-insensitive GLOB and NOT GLOB
+            elif isinstance(op, ast.Is):
+                return Glob(Lower(left), Lower(right))
+            elif isinstance(op, ast.IsNot):
+                return Not(Glob(Lower(left), Lower(right)))
             else:
                 raise SyntaxError('unknown comparison operation')
-
-            if lower:
-                return 'lower({}) {} lower({})'.format(self._to_sql(root.left),
-                    op, self._to_sql(root.comparators[0]))
-            else:
-                return '({}) {} ({})'.format(self._to_sql(root.left), op,
-                    self._to_sql(root.comparators[0]))
         else:
             raise SyntaxError('unknown syntax tree node {}'
                 .format(ast.dump(root)))
 
-    def to_sql(self):
-        return self.sql
+    def _fulltext_to_expr(self, root):
+        # "words" in body (or signature) uses the full-text index
+        if not isinstance(root.left, ast.Str):
+            raise SyntaxError('left side of "in" must be a string')
+
+        column = self._to_expr(root.comparators[0])
+        if column not in (Column('body'), Column('signature')):
+            raise SyntaxError('right side of "in" must be body or signature')
+
+        # fail early if there are no words to search for
+        fulltext_query(root.left.s, (column.name, ))
+
+        expr = FullText(column.name, root.left.s)
+        if isinstance(root.ops[0], ast.In):
+            return expr
+        return Not(expr)
+
+    def _time_to_expr(self, root):
+        # time compared to a string is compared to the time it describes
+        # (see util.parse_time), like time > "2h ago". time is "period"
+        # (see util.parse_period) selects messages from that period, like
+        # time is "last 2h". relative times are relative to when the filter
+        # is created.
+        left, right = root.left, root.comparators[0]
+        if isinstance(left, ast.Str) and isinstance(right, ast.Name):
+            if not isinstance(root.ops[0], tuple(_flipped_comparisons)):
+                return None
+            op = _flipped_comparisons[type(root.ops[0])]()
+            left, right = right, left
+        else:
+            op = root.ops[0]
+
+        if not (isinstance(left, ast.Name) and
+                (_field_map.get(left.id) == 'time') and
+                isinstance(right, ast.Str)):
+            return None
+
+        try:
+            if isinstance(op, (ast.Is, ast.IsNot)):
+                start, end = parse_period(right.s)
+                expr = Compare('>=', Column('time'),
+                    Literal(to_epoch_us(start)))
+                if end is not None:
+                    expr = And((expr, Compare('<', Column('time'),
+                        Literal(to_epoch_us(end)))))
+                return expr if isinstance(op, ast.Is) else Not(expr)
+
+            time = Literal(to_epoch_us(parse_time(right.s)))
+        except ValueError as error:
+            raise SyntaxError(error.args[0])
+
+        if type(op) not in _comparison_ops:
+            raise SyntaxError('unknown comparison operation')
+        return Compare(_comparison_ops[type(op)], Column('time'), time)
 
     def name(self):
         return self.code
 
 class NopFilter(Filter):
-    def to_sql(self):
-        return '1'
+    def __init__(self):
+        super().__init__(Literal(1))
 
     def name(self):
         return None
@@ -127,26 +201,27 @@ class RelatedFilter(Filter):
                 other_person = message.recipient
 
             self._name = 'personals with {}'.format(other_person)
-            other_sql = sqlite_quote(other_person, lower=True)
-            self.sql = ('(lower(class) GLOB "message") AND '
-                        '((lower(sender) GLOB {}) OR (lower(recipient) GLOB {}))'
-                       ).format(other_sql, other_sql)
+            other_lower = Literal(None if other_person is None
+                else ascii_lower(other_person))
+            expr = And((
+                Compare('=', Column('class_lower'), Literal('message')),
+                Or((Compare('=', Column('sender_lower'), other_lower),
+                    Compare('=', Column('recipient_lower'), other_lower)))))
         else:
+            # related messages are those in the same thread, i.e. those
+            # whose class is the same up to case, un-prefixes and .d
+            # suffixes (and whose instance is, up to case and .d suffixes)
+            expr = Compare('=', Column('class_key'),
+                Literal(thread_key(message.class_)))
             if class_only:
                 self._name = 'class {}'.format(message.class_)
-                class_sql = sqlite_quote('*' + message.class_, lower=True)
-                self.sql = 'lower(class) GLOB {}'.format(class_sql)
             else:
                 self._name = 'instance {}/{}'.format(message.class_,
                     message.instance)
-                class_sql = sqlite_quote('*' + message.class_, lower=True)
-                instance_sql = sqlite_quote('*' + message.instance + '*',
-                    lower=True)
-                self.sql = ('(lower(class) GLOB {}) AND (lower(instance) GLOB {})'
-                           ).format(class_sql, instance_sql)
+                expr = And((expr, Compare('=', Column('instance_key'),
+                    Literal(instance_thread_key(message.instance)))))
 
-    def to_sql(self):
-        return self.sql
+        super().__init__(expr)
 
     def name(self):
         return self._name
@@ -154,10 +229,7 @@ class RelatedFilter(Filter):
 class NegationFilter(Filter):
     def __init__(self, other):
         self._name = 'NOT ({})'.format(other.name())
-        self.sql = 'NOT ({})'.format(other.to_sql())
-
-    def to_sql(self):
-        return self.sql
+        super().__init__(Not(other.source_expr))
 
     def name(self):
         return self._name
@@ -165,10 +237,7 @@ class NegationFilter(Filter):
 class ConjunctionFilter(Filter):
     def __init__(self, first, second):
         self._name = '({}) AND ({})'.format(first.name(), second.name())
-        self.sql = '({}) AND ({})'.format(first.to_sql(), second.to_sql())
-
-    def to_sql(self):
-        return self.sql
+        super().__init__(And((first.source_expr, second.source_expr)))
 
     def name(self):
         return self._name
@@ -0,0 +1,84 @@
+import functools
+import queue
+import time
+
+from datetime import datetime
+
+from instrumentation import stats, timed
+from zephyrgram import Zephyrgram
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_MAX_LATENCY = 0.02 # seconds
+
+class Ingester:
+    def __init__(self, app, zgram_queue):
+        self.app = app
+        self.db = app.db
+        self.subscriber = app.subscriber
+        self.queue = zgram_queue
+
+        self.batch_size = getattr(app.config, 'ingest_batch_size',
+            DEFAULT_BATCH_SIZE)
+        self.max_latency = getattr(app.config, 'ingest_max_latency',
+            DEFAULT_MAX_LATENCY)
+        self.precompute_styles = getattr(app.config, 'precompute_styles',
+            False)
+
+    def take_batch(self):
+        # once we have taken the first message of a batch, we keep waiting
+        # for more to arrive, for at most self.max_latency seconds.
+        # this way a burst of messages is written in one transaction,
+        # instead of paying for one commit per message.
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            try:
+                if deadline is None:
+                    zgram = self.queue.get_nowait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    zgram = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            batch.append(Zephyrgram.from_zpipe(zgram))
+            if deadline is None:
+                deadline = time.monotonic() + self.max_latency
+
+        return batch
+
+    @timed('ingest.drain')
+    def drain(self):
+        # returns the number of messages handed to the database. they might
+        # not be committed yet if the database has a writer thread.
+        ingested = 0
+        while True:
+            batch = self.take_batch()
+            if len(batch) == 0:
+                break
+
+            self.db.ingest(batch,
+                callback=functools.partial(self.committed, batch))
+            ingested += len(batch)
+
+        return ingested
+
+    def committed(self, batch, result):
+        _, new_subs = result
+
+        # if some of these were in class 'ununclass', and we weren't yet
+        # subscribed to 'unununclass', do so
+        self.subscriber.subscribe(new_subs)
+
+        if self.precompute_styles:
+            self.app.config.styles.classify(batch)
+
+        # how long the oldest message took to get from the sender to the
+        # database
+        stats.count('ingest.messages', len(batch))
+        stats.record('ingest.latency',
+            max(0.0, (datetime.now() - batch[0].time).total_seconds()))
+
+        self.app.handle_events([('messages_committed', batch)])
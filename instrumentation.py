@@ -0,0 +1,194 @@
+import collections
+import functools
+import json
+import math
+import textwrap
+import threading
+import time
+
+# histograms have SUBBUCKETS buckets per power of two, so the percentiles
+# they report are at most 1 / SUBBUCKETS too high
+SUBBUCKETS = 8
+
+class Histogram:
+    # counts values (durations, in seconds) in logarithmic buckets, so that
+    # adding one is cheap and percentiles are accurate to a few percent
+    # however many values there are
+    def __init__(self):
+        self.buckets = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            bucket = exponent * SUBBUCKETS + int((mantissa - 0.5) *
+                2 * SUBBUCKETS)
+        else:
+            bucket = None
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def upper_bound(self, bucket):
+        if bucket is None:
+            return 0.0
+        exponent, sub = divmod(bucket, SUBBUCKETS)
+        return math.ldexp(0.5 + (sub + 1) / (2 * SUBBUCKETS), exponent)
+
+    def percentile(self, fraction):
+        if self.count == 0:
+            return 0.0
+
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets, key=lambda b: (b is not None, b)):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.upper_bound(bucket), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count > 0 else 0.0,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+class Stats:
+    # latency histograms per stage (e.g. 'event.filter' or 'db.advance')
+    # and counters, shared by the whole program (see stats below). they
+    # can be updated from any thread.
+    def __init__(self):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = collections.defaultdict(Histogram)
+            self.counters = collections.Counter()
+            self.start_time = time.time()
+
+    def record(self, stage, seconds):
+        if self.enabled:
+            with self.lock:
+                self.histograms[stage].add(seconds)
+
+    def count(self, counter, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[counter] += n
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'start_time': self.start_time,
+                'elapsed': time.time() - self.start_time,
+                'stages': {stage: histogram.summary()
+                    for stage, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+            }
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+stats = Stats()
+
+def timed(stage):
+    # decorator that records how long each call of the function takes
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not stats.enabled:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stats.record(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def trace_statement(statement):
+    # the trace callback of our sqlite connections, called with the text
+    # of every statement they run. statements run by triggers are reported
+    # as comments naming the trigger.
+    words = statement.split(None, 1)
+    kind = words[0].upper() if words else 'EMPTY'
+    if kind == '--':
+        kind = 'TRIGGER'
+    stats.count('sql.statements')
+    stats.count('sql.{}'.format(kind))
+
+SlowQuery = collections.namedtuple('SlowQuery',
+    'time duration statement params plan')
+
+def format_query_plan(rows):
+    # turns the rows of EXPLAIN QUERY PLAN, which form a tree through their
+    # parent ids, into indented lines
+    depths = {0: -1}
+    lines = []
+    for id_, parent, _, detail in rows:
+        depths[id_] = depths.get(parent, -1) + 1
+        lines.append('  ' * depths[id_] + detail)
+    return lines
+
+def is_full_scan(plan):
+    # whether the plan reads the whole messages table, i.e. the filter
+    # can't use any index
+    return any(line.strip() in ('SCAN messages', 'SCAN TABLE messages')
+        for line in plan)
+
+def describe_query(statement, plan):
+    # the lines showing a statement and its query plan, in the popup of
+    # the explain command
+    lines = ['  ' + line for line in textwrap.wrap(' '.join(statement.split()),
+        72)]
+    if is_full_scan(plan):
+        lines.append('  full scan, no index can be used:')
+    lines.extend('    ' + line for line in plan)
+    lines.append('')
+    return lines
+
+# how many filters QueryProfiler keeps slow queries for
+SLOW_QUERY_FILTERS = 32
+
+class QueryProfiler:
+    # times the statements that Database runs on the UI thread (see
+    # Database.execute), and keeps the latest ones that took at least
+    # threshold seconds, with their query plans: log_size of them for each
+    # filter, by filter name, for the max_filters filters that had slow
+    # queries most recently
+    def __init__(self, threshold, log_size, max_filters=SLOW_QUERY_FILTERS):
+        self.threshold = threshold
+        self.log_size = log_size
+        self.max_filters = max_filters
+        self.slow_queries = collections.OrderedDict()
+
+    def record(self, db, filter_name, statement, params, seconds):
+        stats.record('sql.query', seconds)
+        if seconds < self.threshold:
+            return
+
+        stats.count('sql.slow_queries')
+        log = self.slow_queries.get(filter_name)
+        if log is None:
+            log = collections.deque(maxlen=self.log_size)
+            self.slow_queries[filter_name] = log
+        self.slow_queries.move_to_end(filter_name)
+        while len(self.slow_queries) > self.max_filters:
+            self.slow_queries.popitem(last=False)
+        log.append(SlowQuery(time.time(), seconds, statement, params,
+            format_query_plan(db.query_plan(statement, params))))
+
+    def slow_queries_for(self, filter_name):
+        # newest first
+        return list(reversed(self.slow_queries.get(filter_name, ())))
@@ -0,0 +1,151 @@
+import collections
+
+from datetime import datetime
+
+from filtering import ParsedFilter
+
+# the properties that a style rule can set
+STYLE_PROPERTIES = ('fg_color', 'bg_color', 'header')
+
+# the colors that fg_color and bg_color can be (MainWindow has a color pair
+# for every two of these)
+COLOR_NAMES = ('default', 'black', 'blue', 'cyan', 'green', 'magenta', 'red',
+    'white', 'yellow')
+
+# how many style ids we remember
+STYLE_IDS_CACHE_SIZE = 4096
+
+class StyleRules:
+    # an ordered list of (filter code, style) rules from the config, where
+    # a style is a dict with some of STYLE_PROPERTIES. the first rule
+    # whose filter accepts a message decides its style; the index of that
+    # rule is the message's style id (None if no rule matches).
+    # style ids are remembered per message (for the STYLE_IDS_CACHE_SIZE
+    # most recently used ones), since messages never change.
+    def __init__(self, rules):
+        self.predicates = []
+        self.styles = []
+        for code, style in rules:
+            unknown = set(style) - set(STYLE_PROPERTIES)
+            if len(unknown) > 0:
+                raise ValueError('unknown style properties {} in rule {}'
+                    .format(', '.join(sorted(unknown)), code))
+
+            for name in ('fg_color', 'bg_color'):
+                if (name in style) and (style[name] not in COLOR_NAMES):
+                    raise ValueError('unknown color {!r} in rule {}'.format(
+                        style[name], code))
+
+            if 'header' in style:
+                _check_header(style['header'], code)
+
+            try:
+                predicate = ParsedFilter(code).matches
+            except SyntaxError as error:
+                raise ValueError('invalid filter in rule {}: {}'.format(code,
+                    error))
+            self.predicates.append(predicate)
+            self.styles.append(dict(style))
+
+        self.style_ids = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.styles)
+
+    def compute_style_id(self, message):
+        for style_id, predicate in enumerate(self.predicates):
+            if predicate(message):
+                return style_id
+        return None
+
+    def classify(self, messages):
+        # finds the style ids of all the given messages (e.g. all the ones
+        # on the screen, or a batch that was just received) in one go
+        if len(self.styles) == 0:
+            return
+
+        for message in messages:
+            if message.rowid is not None:
+                self.style_id(message)
+
+    def style_id(self, message):
+        if message.rowid is None:
+            return self.compute_style_id(message)
+
+        if message.rowid in self.style_ids:
+            self.style_ids.move_to_end(message.rowid)
+            return self.style_ids[message.rowid]
+
+        style_id = self.compute_style_id(message)
+        self.style_ids[message.rowid] = style_id
+        if len(self.style_ids) > STYLE_IDS_CACHE_SIZE:
+            self.style_ids.popitem(last=False)
+        return style_id
+
+    def apply(self, message, properties, is_current, wrap_mode):
+        # returns properties, updated with the style of the message
+        if len(self.styles) == 0:
+            return properties
+
+        style_id = self.style_id(message)
+        if style_id is None:
+            return properties
+
+        style = self.styles[style_id]
+        properties = dict(properties)
+        for name in ('fg_color', 'bg_color'):
+            if name in style:
+                properties[name] = style[name]
+        if 'header' in style:
+            properties['header'] = style['header'].format(
+                **_template_fields(message, is_current, wrap_mode))
+        return properties
+
+class _NoTime:
+    # stands for the time of messages that have none: it formats as an
+    # empty string, whatever the format spec
+    def __format__(self, spec):
+        return ''
+
+# what _check_header formats header templates with
+_SAMPLE_FIELDS = {
+    'prefix': '',
+    'class_': 'class',
+    'instance': 'instance',
+    'sender': 'sender',
+    'recipient': 'recipient',
+    'opcode': '',
+    'auth': '',
+    'signature': 'signature',
+    'time': datetime(2000, 1, 1),
+}
+
+def _check_header(header, code):
+    # header templates are only formatted when messages are drawn, where an
+    # error would bring the whole UI down, so we try them out here
+    try:
+        header.format(**_SAMPLE_FIELDS)
+        header.format(**dict(_SAMPLE_FIELDS, time=_NoTime()))
+    except (KeyError, IndexError, ValueError, AttributeError,
+            TypeError) as error:
+        raise ValueError('invalid header template {!r} in rule {}: {}'
+            .format(header, code, error))
+
+def _template_fields(message, is_current, wrap_mode):
+    # the fields that header templates can use
+    prefix = ''
+    if wrap_mode:
+        # there is no vertical line next to the current message in wrap mode
+        prefix = '- ' if is_current else '  '
+
+    return {
+        'prefix': prefix,
+        'class_': message.class_,
+        'instance': message.instance,
+        'sender': message.sender or '',
+        'recipient': message.recipient or '',
+        'opcode': message.opcode,
+        'auth': '' if message.auth else '!',
+        'signature': message.signature,
+        'time': message.time if message.time is not None else _NoTime(),
+    }
@@ -0,0 +1,235 @@
+import collections
+
+from util import take_unprefix
+
+# how many subscribe commands SubscriptionSender sends per turn of the main
+# loop
+DEFAULT_SUBSCRIBE_CHUNK_SIZE = 200
+
+# errors come back for commands some time after they are sent. we remember
+# which job sent each of the last SENT_COMMANDS_WINDOW commands, to blame
+# those errors on.
+SENT_COMMANDS_WINDOW = 4096
+
+def unclasses(class_, instance, recipient, start, stop):
+    # the (class, instance, recipient) triples for the unclasses of class_
+    # with undepths start <= i < stop
+    return [('un'*i + class_, instance, recipient) for i in range(start, stop)]
+
+class SubscriptionIndex:
+    # a copy of the subscriptions table that Database keeps in memory, so
+    # that incoming messages can be checked against it without any queries.
+    # it maps each class (without its un- prefixes) to a dict from (instance,
+    # recipient) to the undepth of that subscription. only Database should
+    # change it, together with the table.
+    def __init__(self, rows=()):
+        self.classes = {}
+        # the smallest undepth of the subscriptions to each class: messages
+        # in unclasses shallower than that can't change anything
+        self.min_undepths = {}
+
+        for class_, instance, recipient, undepth in rows:
+            self.classes.setdefault(class_, {})[(instance, recipient)] = \
+                undepth
+        for class_ in self.classes:
+            self.update_min_undepth(class_)
+
+    def __len__(self):
+        return sum(len(subs) for subs in self.classes.values())
+
+    def __iter__(self):
+        # yields (class, instance, recipient, undepth), like the rows of
+        # the table
+        for class_, subs in self.classes.items():
+            for (instance, recipient), undepth in subs.items():
+                yield class_, instance, recipient, undepth
+
+    def update_min_undepth(self, class_):
+        subs = self.classes.get(class_)
+        if subs:
+            self.min_undepths[class_] = min(subs.values())
+        else:
+            self.classes.pop(class_, None)
+            self.min_undepths.pop(class_, None)
+
+    def subscribe(self, class_, instance, recipient):
+        # returns the triples that we should newly subscribe to
+        undepth, class_stripped = take_unprefix(class_)
+        subs = self.classes.setdefault(class_stripped, {})
+        existing = subs.get((instance, recipient), -1)
+        if existing >= undepth:
+            return []
+
+        subs[(instance, recipient)] = undepth
+        self.update_min_undepth(class_stripped)
+        return unclasses(class_stripped, instance, recipient, existing + 1,
+            undepth + 1)
+
+    def unsubscribe(self, class_, instance, recipient):
+        # returns the triples that we should unsubscribe from. we can't
+        # unsubscribe from an unclass directly.
+        undepth, _ = take_unprefix(class_)
+        subs = self.classes.get(class_)
+        if (undepth != 0) or (subs is None) or \
+           ((instance, recipient) not in subs):
+            return []
+
+        existing = subs.pop((instance, recipient))
+        self.update_min_undepth(class_)
+        return unclasses(class_, instance, recipient, 0, existing + 1)
+
+    def raise_undepth(self, class_, candidate_undepth):
+        # makes the undepth of every subscription to class_ at least
+        # candidate_undepth, and returns the triples that we should newly
+        # subscribe to
+        if self.min_undepths.get(class_, candidate_undepth) >= \
+           candidate_undepth:
+            return []
+
+        subs = self.classes[class_]
+        result = []
+        for (instance, recipient), undepth in subs.items():
+            if undepth < candidate_undepth:
+                subs[(instance, recipient)] = candidate_undepth
+                result.extend(unclasses(class_, instance, recipient,
+                    undepth + 1, candidate_undepth + 1))
+        self.min_undepths[class_] = candidate_undepth
+        return result
+
+    def observe(self, msgs):
+        # seeing a message in an unclass of depth n (where depth 0 is the
+        # class itself) means that we should be subscribed to the unclass of
+        # depth n + 1. returns the undepths that were raised, by stripped
+        # class, and the triples that we should newly subscribe to.
+        raised = {}
+        min_undepths = self.min_undepths
+        for msg in msgs:
+            undepth, class_stripped = take_unprefix(msg.class_)
+            # the common case: a class we aren't subscribed to, or whose
+            # unclasses we are already subscribed to
+            if min_undepths.get(class_stripped, undepth + 1) > undepth:
+                continue
+            raised[class_stripped] = max(undepth + 1,
+                raised.get(class_stripped, 0))
+
+        new_subs = []
+        for class_, undepth in raised.items():
+            new_subs.extend(self.raise_undepth(class_, undepth))
+        return raised, new_subs
+
+class SubscriptionJob:
+    # a batch of subscribe (or unsubscribe) commands. zpipe doesn't confirm
+    # commands that succeed, but reports the ones that fail (through the
+    # error handler), some time after they were sent; so a command is
+    # acknowledged once it has been sent, and failed if an error comes back
+    # for it later.
+    def __init__(self, command, triples, description):
+        self.command = command
+        self.triples = triples
+        self.description = description
+        self.sent = 0
+        # the triples that we know failed, and how many commands failed in
+        # all (zpipe's errors don't say which command they are about)
+        self.failures = []
+        self.failed = 0
+        self.last_error = None
+
+    def done(self):
+        return self.sent == len(self.triples)
+
+    def fail(self, triple, message):
+        if triple is not None:
+            self.failures.append(tuple(triple))
+        self.failed += 1
+        self.last_error = message
+
+    def status(self):
+        if self.done():
+            status = '{}: done, {} sent'.format(self.description, self.sent)
+        else:
+            status = '{}: {}/{} sent'.format(self.description, self.sent,
+                len(self.triples))
+        if len(self.failures) > 0:
+            status += ', {} failed (first: {})'.format(self.failed,
+                ','.join(self.failures[0]))
+        elif self.failed > 0:
+            status += ', {} failed (last error: {})'.format(self.failed,
+                self.last_error)
+        return status
+
+class SubscriptionSender:
+    # sends subscribe and unsubscribe commands to zpipe, in the order they
+    # were given. they are sent from the main loop (see run()), at most
+    # chunk_size of them per turn, without waiting for zpipe in between, so
+    # that subscribing to thousands of classes doesn't block the UI.
+    # jobs with a description report their progress (and their failures)
+    # with subscription_progress events.
+    def __init__(self, app, zpipe, chunk_size=DEFAULT_SUBSCRIBE_CHUNK_SIZE):
+        self.app = app
+        self.zpipe = zpipe
+        self.chunk_size = chunk_size
+
+        self.jobs = collections.deque()
+        # the jobs that sent the last SENT_COMMANDS_WINDOW (command, triple)
+        # pairs, and the job that last sent each command, to blame errors on
+        self.senders = collections.OrderedDict()
+        self.latest = {}
+
+    def send(self, command, triples, description=None):
+        job = SubscriptionJob(command, list(triples), description)
+        if len(job.triples) > 0:
+            self.jobs.append(job)
+            self.app.wakeup()
+        return job
+
+    def subscribe(self, triples, description=None):
+        return self.send('subscribe', triples, description)
+
+    def unsubscribe(self, triples, description=None):
+        return self.send('unsubscribe', triples, description)
+
+    def run(self):
+        # sends the next chunk of commands. returns the events to handle.
+        budget = self.chunk_size
+        events = []
+        while (budget > 0) and (len(self.jobs) > 0):
+            job = self.jobs[0]
+            send = getattr(self.zpipe, job.command)
+            stop = min(len(job.triples), job.sent + budget)
+            for triple in job.triples[job.sent:stop]:
+                send(*triple)
+                key = (job.command, triple)
+                self.senders[key] = job
+                self.senders.move_to_end(key)
+            while len(self.senders) > SENT_COMMANDS_WINDOW:
+                self.senders.popitem(last=False)
+            budget -= stop - job.sent
+            job.sent = stop
+            self.latest[job.command] = job
+
+            if job.done():
+                self.jobs.popleft()
+            if job.description is not None:
+                events.append(('subscription_progress', job))
+
+        if len(self.jobs) > 0:
+            # come back for the rest on the next turn
+            self.app.wakeup()
+        return events
+
+    def blame(self, error):
+        # returns the job that the error is about, with the failure recorded
+        # in it, or None if it isn't about one of ours. errors of the fake
+        # zpipe say which command failed; the ones of zpipe don't, so all we
+        # can do is count them against the latest job that sent that kind
+        # of command.
+        triple = getattr(error, 'subscription', None)
+        if triple is None:
+            job = self.latest.get(error.operation)
+        else:
+            job = self.senders.get((error.operation, tuple(triple)))
+        if job is None:
+            return None
+
+        job.fail(triple, error.message)
+        return job
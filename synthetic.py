@@ -0,0 +1,114 @@
+# generates synthetic zephyrgrams, resembling real ones: a few classes,
+# instances and senders account for most of the traffic, some messages are
+# personals or in un-classes, and a few have very long bodies. the fake
+# zpipe sends them as traffic, and the benchmarks build archives from them.
+
+import itertools
+import random
+
+from datetime import datetime, timedelta
+
+from zephyrgram import Zephyrgram
+
+PRINCIPAL = 'me@ATHENA.MIT.EDU'
+
+CLASSES = ['help', 'sipb', 'consult', 'geek', 'white-magic', 'remit', 'ua',
+    'scripts', 'mit', 'xvm', 'debathena', 'linerva', 'zephyr', 'moira',
+    'snowball', 'barnowl']
+INSTANCES = ['personal', 'urgent', 'lunch', 'dinner', 'build', 'outage',
+    'kerberos', 'afs', 'printing', 'email', 'question', 'random', 'python',
+    'sql', 'curses', 'tea', 'bike', 'snow']
+WORDS = ['the', 'a', 'is', 'to', 'of', 'and', 'in', 'that', 'it', 'for',
+    'on', 'with', 'anyone', 'know', 'why', 'athena', 'server', 'broken',
+    'fixed', 'works', 'again', 'lunch', 'today', 'tomorrow', 'kerberos',
+    'ticket', 'afs', 'locker', 'zephyr', 'wagtail', 'database', 'query',
+    'slow', 'fast', 'python', 'curses', 'terminal', 'ssh', 'printer',
+    'déjà', 'naïve', 'café', '42', 'http://example.com/', ':)']
+
+class ArchiveApp:
+    # the parts of Wagtail that Database needs
+    principal = PRINCIPAL
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_database_path(self):
+        return self.path
+
+    def wakeup(self):
+        pass
+
+def zipf_weights(count, exponent=1.1):
+    return list(itertools.accumulate(1 / (rank ** exponent)
+        for rank in range(1, count + 1)))
+
+class ArchiveGenerator:
+    def __init__(self, seed=0, classes=200, senders=2000,
+        personal_fraction=0.15, unclass_fraction=0.03,
+        long_body_fraction=0.01):
+        self.rng = random.Random(seed)
+        self.personal_fraction = personal_fraction
+        self.unclass_fraction = unclass_fraction
+        self.long_body_fraction = long_body_fraction
+
+        self.classes = CLASSES + ['class{}'.format(i)
+            for i in range(max(0, classes - len(CLASSES)))]
+        self.class_weights = zipf_weights(len(self.classes))
+        self.instance_weights = zipf_weights(len(INSTANCES))
+        self.senders = ['user{}@ATHENA.MIT.EDU'.format(i)
+            for i in range(senders)]
+        self.sender_weights = zipf_weights(senders)
+        self.word_weights = zipf_weights(len(WORDS), exponent=0.8)
+
+        self.time = datetime(2010, 1, 1)
+
+    def choose(self, population, cum_weights):
+        return self.rng.choices(population, cum_weights=cum_weights)[0]
+
+    def line(self, words):
+        return ' '.join(self.rng.choices(WORDS, cum_weights=self.word_weights,
+            k=words))
+
+    def body(self):
+        if self.rng.random() < self.long_body_fraction:
+            lines = self.rng.randrange(50, 500)
+        else:
+            lines = min(1 + int(self.rng.expovariate(0.7)), 30)
+        return '\n'.join(self.line(self.rng.randrange(1, 20))
+            for i in range(lines))
+
+    def message(self):
+        self.time += timedelta(seconds=self.rng.expovariate(1 / 30))
+        sender = self.choose(self.senders, self.sender_weights)
+
+        if self.rng.random() < self.personal_fraction:
+            class_ = self.rng.choice(['message', 'MESSAGE'])
+            instance = self.rng.choice(['personal', 'PERSONAL', 'urgent'])
+            if self.rng.random() < 0.5:
+                recipient = PRINCIPAL
+            else:
+                # one that we sent
+                sender, recipient = PRINCIPAL, sender
+        else:
+            class_ = self.choose(self.classes, self.class_weights)
+            if self.rng.random() < self.unclass_fraction:
+                class_ = 'un' * self.rng.randrange(1, 4) + class_
+            if self.rng.random() < 0.01:
+                class_ += '.d'
+            instance = self.choose(INSTANCES, self.instance_weights)
+            recipient = '*'
+
+        return Zephyrgram(rowid=None,
+            sender=sender,
+            class_=class_,
+            instance=instance,
+            recipient=recipient,
+            opcode=self.rng.choice(['', '', '', '', 'auto']),
+            auth=self.rng.random() < 0.98,
+            time=self.time,
+            signature=self.line(self.rng.randrange(0, 4)),
+            body=self.body())
+
+    def messages(self, count):
+        for i in range(count):
+            yield self.message()
@@ -0,0 +1,32 @@
+import os.path
+import tempfile
+import unittest
+
+from datetime import datetime
+
+from db import Database
+from filtering import ParsedFilter
+from synthetic import ArchiveApp
+from zephyrgram import Zephyrgram
+
+class NonFiniteLiteralTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = Database(ArchiveApp(os.path.join(self.directory.name,
+            'database.sqlite3')))
+        self.db.append_messages([Zephyrgram(None, 'a@ATHENA.MIT.EDU', 'help',
+            'i', '*', '', True, datetime(2020, 1, 1), '', 'body')])
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def check(self, code, expected):
+        filter = ParsedFilter(code)
+        self.assertEqual(self.db.count_messages_after(-1, filter), expected)
+        message = self.db.get_message(1)
+        self.assertEqual(filter.matches(message), expected == 1)
+
+    def test_overflowing_literals(self):
+        self.check('time > 1e999', 0)
+        self.check('time < 1e999', 1)
@@ -0,0 +1,52 @@
+# run with "python -m pytest tests" from the top of the repository
+import os.path
+import tempfile
+import unittest
+
+from bench.suite import HeadlessApp
+from db import Database, _insert_messages
+from synthetic import ArchiveApp, ArchiveGenerator
+
+class UnannouncedMessagesTest(unittest.TestCase):
+    # with a writer thread, the UI can see messages that were committed
+    # before messages_added() tells MainWindow about them
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'database.sqlite3')
+        self.db = Database(ArchiveApp(path), writer_thread=True)
+        self.generator = ArchiveGenerator(seed=1)
+        self.db.append_messages(list(self.generator.messages(5)))
+
+        self.app = HeadlessApp(path, self.db, self.directory.name, 24, 80)
+        self.window = self.app.main_window
+        self.press('G')
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def press(self, key):
+        self.window.handle_keypress(key)
+        self.app.renderer.render(force=True)
+
+    def commit_unannounced(self, count):
+        self.db.write(_insert_messages, list(self.generator.messages(count)))
+
+    def test_cache_refetches_past_exhausted_window(self):
+        cache = self.window.cache
+        self.assertTrue(cache.exhausted)
+        self.commit_unannounced(3)
+        messages = cache.get_messages_starting_with(6, 10, self.window.filter)
+        self.assertEqual([m.rowid for m in messages], [6, 7, 8])
+
+    def test_last(self):
+        self.commit_unannounced(3)
+        self.press('G')
+        self.assertEqual(self.window.current_index, 8)
+
+    def test_next(self):
+        self.commit_unannounced(3)
+        self.press('j')
+        self.assertEqual(self.window.current_index, 6)
+        self.press('j')
+        self.assertEqual(self.window.current_index, 7)
@@ -0,0 +1,51 @@
+import os.path
+import tempfile
+import unittest
+
+from configmanager import ConfigManager
+from styling import StyleRules
+
+class StyleRulesTest(unittest.TestCase):
+    def test_valid_rules(self):
+        rules = StyleRules([
+            ('class_ is "help"', {'fg_color': 'white', 'bg_color': 'blue',
+                'header': '{prefix}{class_} {time:%H:%M}'}),
+        ])
+        self.assertEqual(len(rules), 1)
+
+    def test_invalid_filter(self):
+        with self.assertRaises(ValueError):
+            StyleRules([('class_ is', {'fg_color': 'red'})])
+        with self.assertRaises(ValueError):
+            StyleRules([('clas is "help"', {'fg_color': 'red'})])
+
+    def test_unknown_color(self):
+        with self.assertRaises(ValueError):
+            StyleRules([('class_ is "help"', {'fg_color': 'purple'})])
+        with self.assertRaises(ValueError):
+            StyleRules([('class_ is "help"', {'bg_color': 'Red'})])
+
+    def test_invalid_header(self):
+        with self.assertRaises(ValueError):
+            StyleRules([('class_ is "help"', {'header': '{sendr}'})])
+
+class ReloadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'config.py')
+        self.config = ConfigManager(self)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_config_path(self):
+        return self.path
+
+    def test_broken_rule_keeps_previous_config(self):
+        styles = self.config.styles
+        with open(self.path, 'a') as f:
+            f.write("style_rules = [('class_ is', {'fg_color': 'red'})]\n")
+        with self.assertRaises(ValueError):
+            self.config.reload()
+        self.assertIs(self.config.styles, styles)
+        self.assertEqual(self.config.style_rules, [])
@@ -0,0 +1,18 @@
+import unittest
+
+from datetime import timedelta
+
+from util import parse_duration
+
+class ParseDurationTest(unittest.TestCase):
+    def test_units(self):
+        self.assertEqual(parse_duration('2h'), timedelta(hours=2))
+        self.assertEqual(parse_duration('90 min'), timedelta(minutes=90))
+        self.assertEqual(parse_duration('1.5 days'), timedelta(days=1.5))
+        self.assertEqual(parse_duration('3 weeks'), timedelta(weeks=3))
+        self.assertEqual(parse_duration('10 secs'), timedelta(seconds=10))
+
+    def test_unknown_units(self):
+        for text in ('5ms', '5 hs', '2 months', 'ss', '5'):
+            with self.assertRaises(ValueError, msg=text):
+                parse_duration(text)
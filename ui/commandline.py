@@ -1,11 +1,11 @@
 import shlex
 
 import curses
-import curses.panel
 
 from args import StandaloneArgParser, ArgParserException
 from filtering import NopFilterSingleton, ParsedFilter
 from ui.utils import curse_string
+from util import parse_time
 
 def parse_cmdline_into_events(cmdline):
     result = []
@@ -31,6 +31,13 @@ def parse_cmdline_into_events(cmdline):
                     'Syntax error: {}'.format(error.args[0])))
             else:
                 result.append(('filter', new_filter))
+    elif command == 'goto':
+        try:
+            time = parse_time(args_raw)
+        except ValueError as error:
+            result.append(('status', 'Error: {}'.format(error.args[0])))
+        else:
+            result.append(('goto', time))
     else:
         # now come the commands that do need the args parsed with shlex
         try:
@@ -79,6 +86,20 @@ def parse_cmdline_into_events(cmdline):
                 result.append(('reload_config', ))
             else:
                 result.append(('status', 'reload_config doesn\'t take arguments.'))
+        elif command == 'stats':
+            if args == ['']:
+                result.append(('stats', ))
+            elif args == ['reset']:
+                result.append(('stats_reset', ))
+            elif (len(args) == 2) and (args[0] == 'dump'):
+                result.append(('stats_dump', args[1]))
+            else:
+                result.append(('status', 'usage: stats [reset | dump path]'))
+        elif command == 'explain':
+            if args == ['']:
+                result.append(('explain', ))
+            else:
+                result.append(('status', 'explain doesn\'t take arguments.'))
         elif command == 'quit':
             if len(args) == 0:
                 result.append(('quit', ))
@@ -95,16 +116,16 @@ class CommandLine:
         self.screen = app.screen
         # the position & size really doesn't matter
         # because of the call to update_size() below
-        self.window = curses.newwin(1, 1, 0, 0)
+        self.window = self.screen.newwin(1, 1, 0, 0)
         self.cols = 1
-        self.panel = curses.panel.new_panel(self.window)
+        self.panel = self.screen.new_panel(self.window)
 
         self.input = list(initial_input)
         self.cursor = len(self.input)
         self.first_displayed_character = 0
 
         # turn the cursor on
-        curses.curs_set(1)
+        self.screen.curs_set(1)
 
         self.update_size()
 
@@ -132,7 +153,7 @@ class CommandLine:
         screen_lines, self.cols = self.screen.getmaxyx()
         self.window.resize(1, self.cols)
         self.panel.move(screen_lines - 2, 0)
-        curses.panel.update_panels()
+        self.screen.update_panels()
 
         self.redraw()
 
@@ -167,7 +188,7 @@ class CommandLine:
 
     def close(self):
         self.panel.hide()
-        curses.panel.update_panels()
+        self.screen.update_panels()
         del self.panel
 
-        curses.curs_set(0)
+        self.screen.curs_set(0)
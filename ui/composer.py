@@ -1,5 +1,4 @@
 import curses
-import curses.panel
 
 from ui.utils import curse_string
 
@@ -20,8 +19,8 @@ class ZephyrgramComposer:
         self.config = app.config
         # the position & size really doesn't matter
         # because of the call to update_size() below
-        self.window = curses.newwin(1, 1, 0, 0)
-        self.panel = curses.panel.new_panel(self.window)
+        self.window = self.screen.newwin(1, 1, 0, 0)
+        self.panel = self.screen.new_panel(self.window)
 
         self.editor_lines = 7
         self.editor_cols = 80
@@ -34,7 +33,7 @@ class ZephyrgramComposer:
         self.zwrite_opts = zwrite_opts
 
         # turn the cursor on
-        curses.curs_set(1)
+        self.screen.curs_set(1)
 
         self.update_size()
 
@@ -50,19 +49,19 @@ class ZephyrgramComposer:
 
         # curses.textpad.rectangle is broken for rectangles touching the lower
         # right corner
-        self.window.vline(1, 0, curses.ACS_VLINE, self.editor_lines)
-        self.window.hline(0, 1 + len(title), curses.ACS_HLINE,
+        self.window.vline(1, 0, self.screen.ACS_VLINE, self.editor_lines)
+        self.window.hline(0, 1 + len(title), self.screen.ACS_HLINE,
             self.editor_cols - len(title))
         self.window.hline(self.editor_lines + 1, 1,
-            curses.ACS_HLINE, self.editor_cols)
+            self.screen.ACS_HLINE, self.editor_cols)
         self.window.vline(1, self.editor_cols + 1,
-            curses.ACS_VLINE, self.editor_lines)
-        self.window.addch(0, 0, curses.ACS_ULCORNER)
-        self.window.addch(0, self.editor_cols + 1, curses.ACS_URCORNER)
-        self.window.addch(self.editor_lines + 1, 0, curses.ACS_LLCORNER)
+            self.screen.ACS_VLINE, self.editor_lines)
+        self.window.addch(0, 0, self.screen.ACS_ULCORNER)
+        self.window.addch(0, self.editor_cols + 1, self.screen.ACS_URCORNER)
+        self.window.addch(self.editor_lines + 1, 0, self.screen.ACS_LLCORNER)
         try:
             self.window.addch(self.editor_lines + 1, self.editor_cols + 1,
-                curses.ACS_LRCORNER)
+                self.screen.ACS_LRCORNER)
         except curses.error:
             pass
 
@@ -100,7 +99,7 @@ class ZephyrgramComposer:
         self.panel.move(screen_lines - (self.editor_lines + 2) - 2,
             screen_cols - self.editor_cols - 2)
 
-        curses.panel.update_panels()
+        self.screen.update_panels()
 
         self.redraw()
 
@@ -217,7 +216,7 @@ class ZephyrgramComposer:
 
     def close(self):
         self.panel.hide()
-        curses.panel.update_panels()
+        self.screen.update_panels()
         del self.panel
 
-        curses.curs_set(0)
+        self.screen.curs_set(0)
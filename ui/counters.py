@@ -0,0 +1,65 @@
+from filtering import NopFilterSingleton
+
+class BelowCounter:
+    # keeps track of how many messages there are after the current one,
+    # both among those accepted by the filter and in total, for the status
+    # bar. the counts are only computed from scratch when the filter
+    # changes or the cursor jumps. moving the cursor adjusts them by
+    # counting just the messages in between, and new messages are checked
+    # against the filter in Python.
+    def __init__(self, db):
+        self.db = db
+        self.invalidate()
+
+    def invalidate(self):
+        self.index = self.filter = None
+
+    def counts(self, index, filter):
+        # returns (messages below, messages below regardless of filter)
+        if (self.index is None) or (filter is not self.filter):
+            self.recount(index, filter)
+        elif index != self.index:
+            self.move(index)
+
+        return self.below, self.below_unfiltered
+
+    def count_between(self, after, up_to):
+        below_unfiltered = self.db.count_messages_between(after, up_to)
+        if self.filter is NopFilterSingleton:
+            return below_unfiltered, below_unfiltered
+        return (self.db.count_messages_between(after, up_to, self.filter),
+            below_unfiltered)
+
+    def recount(self, index, filter):
+        self.index = index
+        self.filter = filter
+        # self.last is the last rowid that has been counted, so that we
+        # don't count messages committed after this point twice
+        self.last = self.db.last_index() or 0
+        self.below, self.below_unfiltered = self.count_between(index,
+            self.last)
+
+    def move(self, index):
+        low, high = sorted((self.index, index))
+        between, between_unfiltered = self.count_between(low,
+            min(high, self.last))
+
+        sign = -1 if index > self.index else +1
+        self.below += sign * between
+        self.below_unfiltered += sign * between_unfiltered
+        self.index = index
+
+    def messages_added(self, messages):
+        if (self.index is None) or (len(messages) == 0):
+            return
+
+        # new messages always come after all the old ones, so we can just
+        # test the ones that we haven't counted yet against the filter,
+        # without asking the database
+        after = max(self.index, self.last)
+        for message in messages:
+            if message.rowid > after:
+                self.below_unfiltered += 1
+                if self.filter.matches(message):
+                    self.below += 1
+        self.last = max(self.last, max(message.rowid for message in messages))
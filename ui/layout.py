@@ -0,0 +1,74 @@
+import collections
+
+from ui.utils import curse_string
+
+# the columns of a message (see db.MESSAGE_COLUMNS) that its layout
+# depends on
+LAYOUT_COLUMNS = ('id', 'body')
+
+class MessageLayout:
+    # the rows that the body of a message takes up on the screen, already
+    # encoded for curses (None for an empty row), and the height of the
+    # message including its header
+    __slots__ = ('rows', 'height', 'header_text', 'header')
+
+    def __init__(self, body, cols, wrap_mode):
+        first_col = 0 if wrap_mode else 4
+
+        self.rows = []
+        for line in body.rstrip().split('\n'):
+            if not wrap_mode:
+                line = line[:cols - first_col]
+
+            if len(line) == 0:
+                self.rows.append(None)
+                continue
+
+            while len(line) > 0:
+                part, line = line[:cols], line[cols:]
+                self.rows.append(curse_string(part))
+
+        self.height = 1 + len(self.rows)
+        self.header_text = self.header = None
+
+    def encoded_header(self, text):
+        # the header comes from the display properties, which can change
+        # between frames, so we only keep the last one
+        if text != self.header_text:
+            self.header_text = text
+            self.header = curse_string(text)
+        return self.header
+
+class LayoutCache:
+    # an LRU cache of message layouts, keyed by (rowid, cols, wrap mode,
+    # config generation). layouts for other widths, wrap modes or
+    # configurations are never used again, so whenever any of those
+    # change, the whole cache is dropped.
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.layouts = collections.OrderedDict()
+        self.params = None
+
+        self.hits = self.misses = 0
+
+    def invalidate(self):
+        self.layouts.clear()
+
+    def get(self, message, cols, wrap_mode, generation):
+        params = (cols, wrap_mode, generation)
+        if params != self.params:
+            self.invalidate()
+            self.params = params
+
+        layout = self.layouts.get(message.rowid)
+        if layout is not None:
+            self.layouts.move_to_end(message.rowid)
+            self.hits += 1
+            return layout
+
+        self.misses += 1
+        layout = MessageLayout(message.body, cols, wrap_mode)
+        self.layouts[message.rowid] = layout
+        if len(self.layouts) > self.capacity:
+            self.layouts.popitem(last=False)
+        return layout
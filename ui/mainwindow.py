@@ -1,23 +1,14 @@
 import shlex
 
 import curses
-import curses.panel
 
 from filtering import (NopFilterSingleton, RelatedFilter, NegationFilter,
     ConjunctionFilter)
-from ui.utils import curse_string
-
-def take_up_to(it, n):
-    res = []
-    for i in range(n):
-        try:
-            element = next(it)
-        except StopIteration:
-            break
-        else:
-            res.append(element)
-    return res
-
+from instrumentation import timed
+from styling import COLOR_NAMES
+from ui.counters import BelowCounter
+from ui.layout import LAYOUT_COLUMNS, LayoutCache
+from ui.messagecache import MessageCache
 
 class MainWindow:
     def __init__(self, app):
@@ -26,58 +17,69 @@ class MainWindow:
         self.config = app.config
         self.screen = app.screen
         self.status_bar = app.status_bar
+        self.renderer = app.renderer
         self.principal = app.principal
         # the size doesn't matter because of the call to update_size() below
-        self.window = curses.newwin(1, 1, 0, 0)
+        self.window = self.screen.newwin(1, 1, 0, 0)
         self.lines = self.cols = 1
-        self.panel = curses.panel.new_panel(self.window)
+        self.panel = self.screen.new_panel(self.window)
 
         self.init_colors()
 
+        self.cache = MessageCache(self.db)
+        self.below_counter = BelowCounter(self.db)
+        self.layouts = LayoutCache()
+
         self.top_index = self.current_index = self.last_visible_message = None
         self.filter = NopFilterSingleton
         self.wrap_mode = False
+
+        # what draw_placement drew last time: a dict from rowids of the
+        # messages on the screen to (first row, number of rows, is current),
+        # and what it depended on
+        self.drawn = self.drawn_state = None
+        self.repainted_messages = 0
+
+        # lets curses scroll the terminal instead of sending it all the
+        # lines again
+        self.window.idlok(True)
+
         self.update_size()
 
     def init_colors(self):
-        self.colors = {
-            'default': -1,
-            'black': curses.COLOR_BLACK,
-            'blue': curses.COLOR_BLUE,
-            'cyan': curses.COLOR_CYAN,
-            'green': curses.COLOR_GREEN,
-            'magenta': curses.COLOR_MAGENTA,
-            'red': curses.COLOR_RED,
-            'white': curses.COLOR_RED,
-            'yellow': curses.COLOR_YELLOW
-        }
+        self.colors = {name: -1 if name == 'default'
+            else getattr(curses, 'COLOR_' + name.upper())
+            for name in COLOR_NAMES}
 
         self.color_pairs = {}
         i = 1
         for fg in self.colors:
             for bg in self.colors:
-                curses.init_pair(i, self.colors[fg], self.colors[bg])
-                self.color_pairs[fg, bg] = curses.color_pair(i)
+                self.screen.init_pair(i, self.colors[fg], self.colors[bg])
+                self.color_pairs[fg, bg] = self.screen.color_pair(i)
                 i += 1
 
+    def layout(self, message):
+        return self.layouts.get(message, self.cols, self.wrap_mode,
+            self.config.generation)
+
     def measure_message_height(self, message):
-        if self.wrap_mode:
-            return 1 + sum((len(line) + self.cols - 1) // self.cols
-                           for line in message.body.rstrip().split('\n'))
-        else:
-            return 2 + message.body.rstrip().count('\n')
+        return self.layout(message).height
 
+    @timed('mainwindow.draw_message')
     def draw_message(self, row, message, is_current):
         properties = self.config.get_zgram_display_properties(message,
             is_current, self.wrap_mode)
         fg = properties.get('fg_color', 'default')
         bg = properties.get('bg_color', 'default')
         color_pair = self.color_pairs[fg, bg]
+        layout = self.layout(message)
 
         header_first_col = 0 if self.wrap_mode else 2
         try:
             self.window.addnstr(row, header_first_col,
-                curse_string(properties.get('header', 'ERROR no header returned')),
+                layout.encoded_header(
+                    properties.get('header', 'ERROR no header returned')),
                 self.cols - header_first_col)
         except curses.error:
             # this might try printing onto the end of the last line of the
@@ -90,59 +92,36 @@ class MainWindow:
             # (instead of doing chgat on the entire line after printing the
             # line) because, for some reason, if we apply chgat to the pipe,
             # it turns into an 'x'
-            self.window.addch(row, 0, curses.ACS_VLINE, color_pair)
+            self.window.addch(row, 0, self.screen.ACS_VLINE, color_pair)
 
 
         first_col = 0 if self.wrap_mode else 4
         empty_row = row + 1
-        for line in message.body.rstrip().split('\n'):
-            if not self.wrap_mode:
-                line = line[:self.cols - first_col]
-
-            if len(line) == 0:
-                if empty_row == self.lines:
-                    break
-
-                self.window.chgat(empty_row, 0, -1, color_pair)
-                if is_current and not self.wrap_mode:
-                    self.window.addch(empty_row, 0, curses.ACS_VLINE, color_pair)
-                empty_row += 1
-                continue
-
-            while len(line) > 0:
-                if empty_row == self.lines:
-                    break
+        for part in layout.rows:
+            if empty_row == self.lines:
+                break
 
-                part, line = line[:self.cols], line[self.cols:]
+            if part is not None:
                 try:
-                    self.window.addstr(empty_row, first_col, curse_string(part))
+                    self.window.addstr(empty_row, first_col, part)
                 except curses.error:
                     pass
 
-                self.window.chgat(empty_row, 0, -1, color_pair)
-                if is_current and not self.wrap_mode:
-                    self.window.addch(empty_row, 0, curses.ACS_VLINE, color_pair)
+            self.window.chgat(empty_row, 0, -1, color_pair)
+            if is_current and not self.wrap_mode:
+                self.window.addch(empty_row, 0, self.screen.ACS_VLINE, color_pair)
 
-                empty_row += 1
+            empty_row += 1
 
         return empty_row
 
+    @timed('mainwindow.redraw')
     def redraw(self):
-        self.window.erase()
-
         if self.current_index is None:
             self.current_index = self.db.first_index(filter=self.filter)
 
             if self.current_index is None:
-                # there are no messages, but we should still update the
-                # status bar
-
-                messages_below = 0
-                messages_below_total = self.db.count_messages_after(-1)
-                self.status_bar.update_display(messages_below, messages_below_total,
-                    self.filter.name())
-
-                self.window.noutrefresh()
+                self.draw_empty()
                 return
 
         if (self.top_index is None) or (self.current_index < self.top_index):
@@ -154,19 +133,26 @@ class MainWindow:
 
         # every message takes at least 1 line, so we take $2 * self.lines$
         # messages, which is at least two screens worth of messages
-        messages = take_up_to(
-                self.db.get_messages_starting_with(
-                    self.top_index,
-                    filter=self.filter),
-                2 * self.lines)
+        messages = self.cache.get_messages_starting_with(self.top_index,
+            2 * self.lines, self.filter)
 
         if not any(msg.rowid == self.current_index for msg in messages):
             # if the current message is not in this list at all,
             # we give up and put the current message at top
-            # (this happens when a filter is changed)
+            # (this happens when a filter is changed, or when it was just
+            # committed and the cache hasn't heard of it yet)
             self.top_index = self.current_index
-            self.redraw()
-            return
+            self.cache.messages_added()
+            messages = self.cache.get_messages_starting_with(self.top_index,
+                2 * self.lines, self.filter)
+
+            if not any(msg.rowid == self.current_index for msg in messages):
+                # the current message isn't accepted by the filter after
+                # all, so we move to the next one that is, if any
+                if len(messages) == 0:
+                    self.draw_empty()
+                    return
+                self.current_index = self.top_index = messages[0].rowid
 
         # we don't want the current message to ever start below the lower half
         # of the screen
@@ -179,44 +165,121 @@ class MainWindow:
             messages = messages[1:]
             self.top_index = messages[0].rowid
 
-        start_row = 0
-        for msg in messages:
-            next_start_row = self.draw_message(start_row, msg,
-                msg.rowid == self.current_index)
-
-            self.last_visible_message = msg.rowid
+        # we decide which style rule applies to all the messages at once
+        self.config.styles.classify(messages)
 
-            if next_start_row == self.lines:
+        # where each message goes: (message, first row, number of rows)
+        placement = []
+        row = 0
+        for msg in messages:
+            height = min(self.measure_message_height(msg), self.lines - row)
+            placement.append((msg, row, height))
+            row += height
+            if row == self.lines:
                 break
 
-            start_row = next_start_row
-
+        self.last_visible_message = placement[-1][0].rowid
+        self.draw_placement(placement)
         self.window.noutrefresh()
 
         # we should also update the status bar
-        messages_below = self.db.count_messages_after(self.current_index,
-            filter=self.filter)
-        messages_below_total = messages_below
-        if self.filter is not NopFilterSingleton:
-            messages_below_total = self.db.count_messages_after(
-                self.current_index)
+        messages_below, messages_below_total = self.below_counter.counts(
+            self.current_index, self.filter)
         self.status_bar.update_display(messages_below, messages_below_total,
             self.filter.name())
 
+    def draw_empty(self):
+        # there are no messages to show, but we should still update the
+        # status bar
+        messages_below, messages_below_total = \
+            self.below_counter.counts(-1, self.filter)
+        self.status_bar.update_display(messages_below, messages_below_total,
+            self.filter.name())
+
+        self.window.erase()
+        self.drawn = None
+        self.window.noutrefresh()
+
+    def draw_placement(self, placement):
+        # we only repaint what has changed since the last redraw: if the
+        # messages on screen have moved, we scroll the window instead of
+        # repainting them, and messages are repainted only if they were
+        # not entirely on the screen, or have become or stopped being the
+        # current message.
+        state = (self.lines, self.cols, self.wrap_mode, self.config.generation)
+        shift = None
+        if (self.drawn is not None) and (self.drawn_state == state) and \
+           not self.config.volatile_display_properties():
+            for msg, row, _ in placement:
+                if msg.rowid in self.drawn:
+                    shift = self.drawn[msg.rowid][0] - row
+                    break
+
+        if (shift is None) or (abs(shift) >= self.lines):
+            self.window.erase()
+            shift = None
+        elif shift != 0:
+            # scrolling is only allowed for the duration of this call, since
+            # otherwise writing to the bottom right corner would scroll too
+            self.window.scrollok(True)
+            self.window.scroll(shift)
+            self.window.scrollok(False)
+
+        drawn = {}
+        intact_rows = set()
+        repaint = []
+        for msg, row, height in placement:
+            is_current = msg.rowid == self.current_index
+            drawn[msg.rowid] = (row, height, is_current)
+
+            old = self.drawn.get(msg.rowid) if shift is not None else None
+            if (old is not None) and (old[0] - shift == row) and \
+               (old[1] >= height) and (old[2] == is_current):
+                intact_rows.update(range(row, row + height))
+            else:
+                repaint.append((msg, row, is_current))
+
+        if shift is not None:
+            for row in range(self.lines):
+                if row not in intact_rows:
+                    self.window.move(row, 0)
+                    self.window.clrtoeol()
+
+        for msg, row, is_current in repaint:
+            self.draw_message(row, msg, is_current)
+        self.repainted_messages += len(repaint)
+
+        self.drawn = drawn
+        self.drawn_state = state
+
     def move_to(self, index):
         self.current_index = index
+        self.below_counter.invalidate()
+
+        self.renderer.mark_dirty(self)
 
-        self.redraw()
+    def go_to_time(self, time):
+        # returns whether there is a message to go to
+        index = self.db.first_index_at(time, filter=self.filter)
+        if index is None:
+            return False
+        self.move_to(index)
+        return True
 
     def advance(self, delta):
         if self.current_index is None:
-            self.redraw()
+            self.renderer.mark_dirty(self)
             return
 
         self.current_index = self.db.advance(self.current_index, delta,
             filter=self.filter)
 
-        self.redraw()
+        self.renderer.mark_dirty(self)
+
+    def messages_added(self, messages):
+        self.cache.messages_added()
+        self.below_counter.messages_added(messages)
+        self.renderer.mark_dirty(self)
 
     def update_size(self):
         self.lines, self.cols = self.screen.getmaxyx()
@@ -224,9 +287,9 @@ class MainWindow:
 
         self.window.resize(self.lines, self.cols)
 
-        curses.panel.update_panels()
+        self.screen.update_panels()
 
-        self.redraw()
+        self.renderer.mark_dirty(self)
 
     def set_filter(self, new_filter):
         self.filter = new_filter
@@ -235,7 +298,7 @@ class MainWindow:
             # it by the closest message that is
             self.current_index = self.db.advance(self.current_index, 0,
                 filter=self.filter)
-        self.redraw()
+        self.renderer.mark_dirty(self)
 
     def handle_keypress(self, key):
         result = []
@@ -249,12 +312,16 @@ class MainWindow:
         elif (key == '>') or (key == 'G'):
             self.move_to(self.db.last_index(filter=self.filter))
         elif key == curses.KEY_PPAGE: # Previous Page
-            # TODO: this does not actually work well, it just
-            # scrolls up by one pretty much all the time
+            # we show the screenful of messages right above the top one
+            self.renderer.flush(self)
             if self.top_index is not None:
-                self.move_to(self.db.advance(self.top_index, -1,
-                    filter=self.filter))
+                page = self.db.get_page(self.top_index, self.lines,
+                    self.measure_message_height, backwards=True,
+                    filter=self.filter, columns=LAYOUT_COLUMNS)
+                if len(page) > 0:
+                    self.move_to(page[0])
         elif key == curses.KEY_NPAGE: # Next Page
+            self.renderer.flush(self)
             if self.last_visible_message is not None:
                 self.move_to(self.db.advance(self.last_visible_message, +1,
                     filter=self.filter))
@@ -267,7 +334,7 @@ class MainWindow:
                 return result
 
             # TODO: add a key for "send personal to sender of this message"
-            message = self.db.get_message(self.current_index)
+            message = self.cache.get(self.current_index)
             if message is not None:
                 event = 'cmdline_exec' if key == 'r' else 'cmdline_open'
                 if message.is_personal():
@@ -293,19 +360,19 @@ class MainWindow:
             if self.current_index is None:
                 return result
 
-            message = self.db.get_message(self.current_index)
+            message = self.cache.get(self.current_index)
             new_filter = RelatedFilter(self.app, message, key == 'N')
 
             result.append(('filter', new_filter))
         elif key == 'w':
             self.wrap_mode = not self.wrap_mode
-            self.redraw()
+            self.renderer.mark_dirty(self)
         elif key == 's':
             # skip current thread
             if self.current_index is None:
                 return result
 
-            message = self.db.get_message(self.current_index)
+            message = self.cache.get(self.current_index)
             unrelated_filter = ConjunctionFilter(self.filter,
                 NegationFilter(RelatedFilter(self.app, message)))
             next_message = self.db.advance(self.current_index, 0,
@@ -319,7 +386,8 @@ class MainWindow:
             else:
                 self.current_index = next_message
 
-            self.redraw()
+            self.below_counter.invalidate()
+            self.renderer.mark_dirty(self)
         elif key == 'q':
             result.append(('quit', ))
         else:
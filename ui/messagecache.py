@@ -0,0 +1,101 @@
+import bisect
+import collections
+
+class MessageCache:
+    # an LRU cache of Zephyrgrams keyed by rowid, plus a sliding window
+    # of the rowids accepted by the active filter around the viewport.
+    # messages never change once they are in the database, so cached
+    # messages stay valid forever, and only the window needs invalidating
+    # when the filter changes or new messages arrive.
+    def __init__(self, db, capacity=1024):
+        self.db = db
+        self.capacity = capacity
+        self.messages = collections.OrderedDict()
+
+        self.hits = self.misses = 0
+
+        self.reset_window(None)
+
+    def reset_window(self, filter):
+        # the window consists of all rowids in [self.start, self.end]
+        # that are accepted by self.filter. if self.exhausted is set, there
+        # were no such rowids after self.end last time we checked (or since
+        # messages_added() was last called).
+        self.filter = filter
+        self.window = []
+        self.start = self.end = None
+        self.exhausted = False
+
+    def messages_added(self):
+        self.exhausted = False
+
+    def store(self, message):
+        self.messages[message.rowid] = message
+        self.messages.move_to_end(message.rowid)
+        if len(self.messages) > self.capacity:
+            self.messages.popitem(last=False)
+
+    def get(self, rowid):
+        message = self.messages.get(rowid)
+        if message is not None:
+            self.messages.move_to_end(rowid)
+            self.hits += 1
+            return message
+
+        self.misses += 1
+        message = self.db.get_message(rowid)
+        if message is not None:
+            self.store(message)
+        return message
+
+    def fetch(self, messages, fresh):
+        # stores messages freshly read from the database (also in the dict
+        # fresh), returns their rowids
+        self.misses += len(messages)
+        for message in messages:
+            self.store(message)
+            fresh[message.rowid] = message
+        return [message.rowid for message in messages]
+
+    def get_messages_starting_with(self, index, count, filter):
+        # returns up to count messages accepted by filter whose rowids are
+        # at least index. only the messages not already in the window are
+        # read from the database.
+        fresh = {}
+        if (filter is not self.filter) or (self.start is None) or \
+           (index > self.end + 1):
+            self.reset_window(filter)
+            self.start, self.end = index, index - 1
+        elif index < self.start:
+            new = self.fetch(self.db.get_messages_between(index, self.start,
+                filter=filter, limit=count), fresh)
+            if len(new) < count:
+                # the new messages join up with the window
+                self.window = new + self.window
+            else:
+                self.window = new
+                self.end = new[-1]
+                self.exhausted = False
+            self.start = index
+
+        position = bisect.bisect_left(self.window, index)
+        missing = count - (len(self.window) - position)
+        # with a writer thread, we can see messages that were just committed
+        # before messages_added() is called, and be asked for them, so we
+        # don't trust self.exhausted when asked for rowids past the window
+        if (missing > 0) and ((not self.exhausted) or (index >= self.end)):
+            new = self.fetch(list(self.db.get_messages_starting_with(
+                self.end + 1, filter=filter, limit=missing)), fresh)
+            self.window.extend(new)
+            if len(new) > 0:
+                self.end = new[-1]
+            self.exhausted = len(new) < missing
+
+        # we don't let the window grow without bound when scrolling forward
+        if position > count:
+            self.start = self.window[position - count - 1] + 1
+            del self.window[:position - count]
+            position = count
+
+        return [fresh[rowid] if rowid in fresh else self.get(rowid)
+            for rowid in self.window[position:position + count]]
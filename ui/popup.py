@@ -0,0 +1,87 @@
+import curses
+
+from ui.utils import curse_string
+
+class Popup:
+    # a box in the middle of the screen showing lines of text (self.rows,
+    # under self.title), which can be scrolled with j/k and closed with q
+    def __init__(self, app, title='', rows=()):
+        self.screen = app.screen
+        # the position & size really doesn't matter
+        # because of the call to update_size() below
+        self.window = self.screen.newwin(1, 1, 0, 0)
+        self.panel = self.screen.new_panel(self.window)
+
+        self.title = title
+        self.rows = list(rows)
+        self.top = 0
+        self.update_size()
+
+    def redraw(self):
+        self.window.erase()
+
+        # curses.textpad.rectangle is broken for rectangles touching the lower
+        # right corner
+        self.window.hline(0, 1, self.screen.ACS_HLINE, self.cols - 2)
+        self.window.hline(self.lines - 1, 1, self.screen.ACS_HLINE,
+            self.cols - 2)
+        self.window.vline(1, 0, self.screen.ACS_VLINE, self.lines - 2)
+        self.window.vline(1, self.cols - 1, self.screen.ACS_VLINE,
+            self.lines - 2)
+        self.window.addch(0, 0, self.screen.ACS_ULCORNER)
+        self.window.addch(0, self.cols - 1, self.screen.ACS_URCORNER)
+        self.window.addch(self.lines - 1, 0, self.screen.ACS_LLCORNER)
+        try:
+            self.window.addch(self.lines - 1, self.cols - 1,
+                self.screen.ACS_LRCORNER)
+        except curses.error:
+            pass
+
+        self.window.addnstr(0, 2, curse_string(' {} '.format(self.title)),
+            self.cols - 4)
+
+        visible = self.lines - 2
+        self.top = max(0, min(self.top, len(self.rows) - visible))
+        for y, row in enumerate(self.rows[self.top:self.top + visible]):
+            self.window.addnstr(1 + y, 2, curse_string(row), self.cols - 4)
+
+        self.window.noutrefresh()
+
+    def update_size(self):
+        screen_lines, screen_cols = self.screen.getmaxyx()
+
+        # leave room for the status bar
+        self.lines = max(3, min(len(self.rows) + 2, screen_lines - 4))
+        self.cols = max(4, min(80, screen_cols))
+
+        self.window.resize(self.lines, self.cols)
+        self.panel.move(max(0, (screen_lines - 2 - self.lines) // 2),
+            (screen_cols - self.cols) // 2)
+
+        self.screen.update_panels()
+
+        self.redraw()
+
+    def handle_keypress(self, key):
+        result = []
+
+        if (key == curses.KEY_DOWN) or (key == 'j'):
+            self.top += 1
+        elif (key == curses.KEY_UP) or (key == 'k'):
+            self.top = max(0, self.top - 1)
+        elif key == curses.KEY_NPAGE:
+            self.top += self.lines - 2
+        elif key == curses.KEY_PPAGE:
+            self.top = max(0, self.top - (self.lines - 2))
+        elif (key == 'q') or (key == '\x03') or (key == '\x1b'):
+            result.append(('popup_close', ))
+            return result
+
+        self.redraw()
+
+        return result
+
+    def close(self):
+        self.panel.hide()
+        self.screen.update_panels()
+        del self.panel
@@ -0,0 +1,81 @@
+import time
+
+from instrumentation import stats
+
+DEFAULT_FRAME_INTERVAL = 1 / 60 # seconds
+
+class RenderScheduler:
+    # windows that need to be redrawn are marked dirty, instead of being
+    # redrawn right away, and are then redrawn together in the next frame.
+    # frames are rendered at most once every frame_interval seconds: the
+    # first change after a quiet period is shown right away, and changes
+    # during a burst are shown when the interval is up, so the last one is
+    # never left waiting for more input.
+    def __init__(self, app):
+        self.app = app
+        self.frame_interval = getattr(app.config, 'frame_interval',
+            DEFAULT_FRAME_INTERVAL)
+
+        self.dirty = []
+        self.update_needed = False
+        self.last_frame = None
+
+    def mark_dirty(self, window):
+        if window not in self.dirty:
+            self.dirty.append(window)
+
+    def touch(self):
+        # for windows that draw themselves right away, like the command
+        # line: makes the next frame send their changes to the terminal
+        self.update_needed = True
+
+    def pending(self):
+        return self.update_needed or (len(self.dirty) > 0)
+
+    def flush(self, window):
+        # redraws the window now if it is dirty, for code that needs the
+        # state computed while drawing it (like what is on the screen)
+        if window in self.dirty:
+            self.dirty.remove(window)
+            window.redraw()
+            self.update_needed = True
+
+    def timeout(self):
+        # how long the event loop can wait before the next frame is due
+        if not self.pending():
+            return None
+        if self.last_frame is None:
+            return 0
+        return max(0,
+            self.last_frame + self.frame_interval - time.monotonic())
+
+    def render(self, force=False):
+        # returns whether a frame was rendered
+        if not self.pending():
+            return False
+
+        start = time.monotonic()
+        if (not force) and (self.last_frame is not None) and \
+           (start - self.last_frame < self.frame_interval):
+            # the changes are coalesced into the next frame; the stats
+            # command shows how often that happens
+            stats.count('render.frames_skipped')
+            return False
+
+        # redrawing a window can make others dirty, e.g. the main window
+        # updates the status bar
+        while len(self.dirty) > 0:
+            self.dirty.pop(0).redraw()
+
+        # the cursor goes wherever the window that was refreshed last left
+        # it, which should be the window on top
+        if len(self.app.window_stack) > 0:
+            self.app.window_stack[-1].window.noutrefresh()
+
+        self.app.screen.update_panels()
+        self.app.screen.doupdate()
+        self.update_needed = False
+
+        self.last_frame = time.monotonic()
+        stats.record('render.frame', self.last_frame - start)
+        return True
@@ -0,0 +1,347 @@
+import collections
+import locale
+
+import curses
+import curses.panel
+
+# the windows in ui/ never use curses directly to create windows and panels,
+# refresh the screen and so on; they go through app.screen, which is one of
+# the screens below. windows created by a screen have the interface of
+# curses windows.
+
+class CursesScreen:
+    # a real terminal, through curses. anything not defined here (like
+    # newwin, doupdate or the ACS_* characters, which only exist once curses
+    # is initialized) is taken from the curses module.
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+
+    def getmaxyx(self):
+        return self.stdscr.getmaxyx()
+
+    def get_wch(self):
+        return self.stdscr.get_wch()
+
+    def nodelay(self, flag):
+        self.stdscr.nodelay(flag)
+
+    def new_panel(self, window):
+        return curses.panel.new_panel(window)
+
+    def update_panels(self):
+        curses.panel.update_panels()
+
+    def __getattr__(self, name):
+        return getattr(curses, name)
+
+class VirtualScreen:
+    # a terminal simulated in Python, for running the UI without a TTY.
+    # it keeps what the terminal would show as a grid of (character,
+    # attributes) cells, and counts what drawing and updating the screen
+    # cost: cells written to windows, and cells and bytes that would have
+    # been sent to the terminal.
+    ACS_VLINE = '│'
+    ACS_HLINE = '─'
+    ACS_ULCORNER = '┌'
+    ACS_URCORNER = '┐'
+    ACS_LLCORNER = '└'
+    ACS_LRCORNER = '┘'
+
+    def __init__(self, lines=24, cols=80):
+        self.lines = lines
+        self.cols = cols
+        self.cells = self._blank(lines, cols)
+        self.cursor = (0, 0)
+        self.cursor_visibility = 1
+
+        self.panels = []
+        self.input = collections.deque()
+        self.no_delay = False
+        self.color_pairs = {}
+        self.last_refreshed = None
+
+        self.frames = 0
+        self.cells_drawn = 0
+        self.cells_sent = 0
+        self.bytes_sent = 0
+
+    def _blank(self, lines, cols):
+        return [[(' ', 0)] * cols for i in range(lines)]
+
+    def getmaxyx(self):
+        return self.lines, self.cols
+
+    def newwin(self, lines, cols, y, x):
+        return VirtualWindow(self, lines, cols, y, x)
+
+    def new_panel(self, window):
+        panel = VirtualPanel(self, window)
+        self.panels.append(panel)
+        return panel
+
+    def update_panels(self):
+        pass
+
+    def curs_set(self, visibility):
+        previous = self.cursor_visibility
+        self.cursor_visibility = visibility
+        return previous
+
+    def use_default_colors(self):
+        pass
+
+    def init_pair(self, number, fg, bg):
+        self.color_pairs[number] = (fg, bg)
+
+    def color_pair(self, number):
+        return number << 8
+
+    def resizeterm(self, lines, cols):
+        self.lines = lines
+        self.cols = cols
+        self.cells = self._blank(lines, cols)
+
+    def nodelay(self, flag):
+        self.no_delay = flag
+
+    def feed(self, keys):
+        # queues keys for get_wch: characters as strings, special keys as
+        # curses.KEY_* numbers
+        self.input.extend(keys)
+
+    def get_wch(self):
+        if len(self.input) == 0:
+            # a real terminal would block instead
+            raise curses.error('no input')
+        return self.input.popleft()
+
+    def compose(self):
+        # what the terminal would show: the visible panels, bottom first
+        cells = self._blank(self.lines, self.cols)
+        for panel in self.panels:
+            if panel.hidden:
+                continue
+            window = panel.window
+            for row in range(window.lines):
+                y = window.y + row
+                if not (0 <= y < self.lines):
+                    continue
+                for col in range(window.cols):
+                    x = window.x + col
+                    if 0 <= x < self.cols:
+                        cells[y][x] = window.cells[row][col]
+        return cells
+
+    def doupdate(self):
+        cells = self.compose()
+
+        # we count every run of changed cells as one cursor movement
+        encoding = locale.getpreferredencoding()
+        for y in range(self.lines):
+            in_run = False
+            for x in range(self.cols):
+                if cells[y][x] != self.cells[y][x]:
+                    if not in_run:
+                        self.bytes_sent += len('\x1b[{};{}H'.format(y + 1,
+                            x + 1))
+                        in_run = True
+                    self.cells_sent += 1
+                    self.bytes_sent += len(cells[y][x][0].encode(encoding,
+                        'replace'))
+                else:
+                    in_run = False
+
+        self.cells = cells
+        self.frames += 1
+
+        window = self.last_refreshed
+        if window is not None:
+            self.cursor = (window.y + window.cursor_y,
+                window.x + window.cursor_x)
+
+    def snapshot(self):
+        # the text on the screen, one string per line
+        return [''.join(c for c, _ in row) for row in self.cells]
+
+    def metrics(self):
+        return {
+            'frames': self.frames,
+            'cells_drawn': self.cells_drawn,
+            'cells_sent': self.cells_sent,
+            'bytes_sent': self.bytes_sent,
+        }
+
+class VirtualPanel:
+    def __init__(self, screen, window):
+        self.screen = screen
+        self.window = window
+        self.hidden = False
+
+    def move(self, y, x):
+        self.window.y = y
+        self.window.x = x
+
+    def hide(self):
+        self.hidden = True
+        if self in self.screen.panels:
+            self.screen.panels.remove(self)
+
+    def show(self):
+        self.hidden = False
+        if self not in self.screen.panels:
+            self.screen.panels.append(self)
+
+    def top(self):
+        self.screen.panels.remove(self)
+        self.screen.panels.append(self)
+
+class VirtualWindow:
+    # implements the part of the curses window interface used by wagtail
+    def __init__(self, screen, lines, cols, y, x):
+        self.screen = screen
+        self.lines = lines
+        self.cols = cols
+        self.y = y
+        self.x = x
+        self.background = (' ', 0)
+        self.cells = self._blank_rows(lines)
+        self.cursor_y = self.cursor_x = 0
+        self.can_scroll = False
+
+    def _blank_rows(self, count):
+        return [[self.background] * self.cols for i in range(count)]
+
+    def _text(self, s):
+        if isinstance(s, bytes):
+            return s.decode(locale.getpreferredencoding(), 'replace')
+        if isinstance(s, int):
+            return chr(s)
+        return s
+
+    def _check(self, y, x):
+        if not ((0 <= y < self.lines) and (0 <= x < self.cols)):
+            raise curses.error('position ({}, {}) outside of window'
+                .format(y, x))
+
+    def _put(self, y, x, c, attr):
+        self.cells[y][x] = (c, attr | self.background[1])
+        self.screen.cells_drawn += 1
+
+    def getmaxyx(self):
+        return self.lines, self.cols
+
+    def getbegyx(self):
+        return self.y, self.x
+
+    def idlok(self, flag):
+        pass
+
+    def scrollok(self, flag):
+        self.can_scroll = flag
+
+    def bkgd(self, c, attr=0):
+        old = self.background
+        self.background = (self._text(c), attr)
+        self.cells = [[self.background if cell == old else
+            (cell[0], cell[1] | attr) for cell in row] for row in self.cells]
+
+    def erase(self):
+        self.cells = self._blank_rows(self.lines)
+        self.cursor_y = self.cursor_x = 0
+
+    def move(self, y, x):
+        self._check(y, x)
+        self.cursor_y, self.cursor_x = y, x
+
+    def clrtoeol(self):
+        row = self.cells[self.cursor_y]
+        for x in range(self.cursor_x, self.cols):
+            row[x] = self.background
+
+    def addnstr(self, y, x, s, n, attr=0):
+        text = self._text(s)
+        if n >= 0:
+            text = text[:n]
+        self.addstr(y, x, text, attr)
+
+    def addstr(self, y, x, s, attr=0):
+        # like curses, this wraps onto the next lines, and fails when asked
+        # to write past the end of the window (after writing what fits)
+        self._check(y, x)
+        for c in self._text(s):
+            if c == '\n':
+                for col in range(x, self.cols):
+                    self.cells[y][col] = self.background
+                y, x = y + 1, 0
+                if y == self.lines:
+                    raise curses.error('addstr past the end of the window')
+                continue
+
+            self._put(y, x, c, attr)
+            x += 1
+            if x == self.cols:
+                y, x = y + 1, 0
+                if y == self.lines:
+                    self.cursor_y, self.cursor_x = self.lines - 1, \
+                        self.cols - 1
+                    raise curses.error('addstr past the end of the window')
+        self.cursor_y, self.cursor_x = y, x
+
+    def addch(self, y, x, c, attr=0):
+        self._check(y, x)
+        self._put(y, x, self._text(c), attr)
+        if (y == self.lines - 1) and (x == self.cols - 1):
+            raise curses.error('addch in the lower right corner')
+        self.cursor_y, self.cursor_x = (y, x + 1) if x + 1 < self.cols \
+            else (y + 1, 0)
+
+    def chgat(self, y, x, *args):
+        # chgat(y, x, attr) or chgat(y, x, num, attr), with num = -1 meaning
+        # the rest of the line
+        num, attr = (-1, args[0]) if len(args) == 1 else args
+        self._check(y, x)
+        end = self.cols if num < 0 else min(self.cols, x + num)
+        row = self.cells[y]
+        for col in range(x, end):
+            row[col] = (row[col][0], attr | self.background[1])
+            self.screen.cells_drawn += 1
+
+    def hline(self, y, x, c, n):
+        self._check(y, x)
+        for col in range(x, min(self.cols, x + n)):
+            self._put(y, col, self._text(c), 0)
+
+    def vline(self, y, x, c, n):
+        self._check(y, x)
+        for row in range(y, min(self.lines, y + n)):
+            self._put(row, x, self._text(c), 0)
+
+    def scroll(self, lines=1):
+        if not self.can_scroll:
+            raise curses.error('scrolling is not enabled')
+        if lines > 0:
+            self.cells = self.cells[lines:] + self._blank_rows(
+                min(lines, self.lines))
+        elif lines < 0:
+            self.cells = self._blank_rows(min(-lines, self.lines)) + \
+                self.cells[:lines]
+        self.cells = self.cells[:self.lines]
+
+    def resize(self, lines, cols):
+        self.cells = [(row + [self.background] * cols)[:cols]
+            for row in self.cells[:lines]]
+        self.cells += [[self.background] * cols
+            for i in range(lines - len(self.cells))]
+        self.lines = lines
+        self.cols = cols
+        self.cursor_y = min(self.cursor_y, lines - 1)
+        self.cursor_x = min(self.cursor_x, cols - 1)
+
+    def noutrefresh(self):
+        self.screen.last_refreshed = self
+
+    def instr(self, y, x, n=-1):
+        row = self.cells[y][x:] if n < 0 else self.cells[y][x:x + n]
+        return ''.join(c for c, _ in row).encode(
+            locale.getpreferredencoding(), 'replace')
+
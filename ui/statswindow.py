@@ -0,0 +1,38 @@
+from ui.popup import Popup
+
+def format_ms(seconds):
+    return '{:.3f}'.format(seconds * 1000)
+
+class StatsWindow(Popup):
+    # shows the latency percentiles of every stage and the counters kept in
+    # instrumentation.stats, as they were when it was opened (or last
+    # refreshed with 'r')
+    def __init__(self, app, stats):
+        self.stats = stats
+        super().__init__(app)
+        self.refresh()
+
+    def refresh(self):
+        snapshot = self.stats.snapshot()
+
+        self.rows = ['{:<32} {:>8} {:>10} {:>10} {:>10}'.format(
+            'stage', 'count', 'p50 ms', 'p99 ms', 'max ms')]
+        for stage, summary in sorted(snapshot['stages'].items()):
+            self.rows.append('{:<32} {:>8} {:>10} {:>10} {:>10}'.format(
+                stage[:32], summary['count'], format_ms(summary['p50']),
+                format_ms(summary['p99']), format_ms(summary['max'])))
+
+        self.rows.append('')
+        self.rows.append('{:<32} {:>8}'.format('counter', 'value'))
+        for counter, value in sorted(snapshot['counters'].items()):
+            self.rows.append('{:<32} {:>8}'.format(counter[:32], value))
+
+        self.title = 'stats over the last {:.0f}s'.format(
+            snapshot['elapsed'])
+        self.update_size()
+
+    def handle_keypress(self, key):
+        if key == 'r':
+            self.refresh()
+            return []
+        return super().handle_keypress(key)
@@ -1,16 +1,16 @@
 import curses
-import curses.panel
 
 from ui.utils import curse_string
 
 class StatusBar:
     def __init__(self, app):
         self.screen = app.screen
+        self.renderer = app.renderer
         # the position & size really doesn't matter
         # because of the call to update_size() below
-        self.window = curses.newwin(1, 1, 0, 0)
+        self.window = self.screen.newwin(1, 1, 0, 0)
         self.cols = 1
-        self.panel = curses.panel.new_panel(self.window)
+        self.panel = self.screen.new_panel(self.window)
 
         self.status = ''
         self.below = 0
@@ -62,24 +62,24 @@ class StatusBar:
         self.below = below
         self.below_unfiltered = below_unfiltered
         self.filter_name = filter_name
-        self.redraw()
+        self.renderer.mark_dirty(self)
 
     def set_status(self, status):
         self.status = status
-        self.redraw()
+        self.renderer.mark_dirty(self)
 
     def clear_status(self):
         self.status = ''
-        self.redraw()
+        self.renderer.mark_dirty(self)
 
     def update_size(self):
         screen_lines, self.cols = self.screen.getmaxyx()
         self.window.resize(2, self.cols)
         self.panel.move(screen_lines - 2, 0)
 
-        curses.panel.update_panels()
+        self.screen.update_panels()
 
-        self.redraw()
+        self.renderer.mark_dirty(self)
 
     def handle_keypress(self, key):
         return []
@@ -1,7 +1,11 @@
 import os
 import pwd
+import re
+import string
 import subprocess
 
+from datetime import datetime, timedelta
+
 def get_principal():
     if os.getenv('WAGTAIL_PRINCIPAL'):
         return os.getenv('WAGTAIL_PRINCIPAL')
@@ -30,3 +34,105 @@ def take_unprefix(class_):
         res += 1
         class_ = class_[2:]
     return res, class_
+
+_ascii_lowercase_table = str.maketrans(string.ascii_uppercase,
+    string.ascii_lowercase)
+
+def ascii_lower(s):
+    # behaves exactly like SQLite's built-in lower(), which only folds ASCII
+    return s.translate(_ascii_lowercase_table)
+
+def thread_key(name):
+    # normalizes a class name, so that e.g. 'UnFoo' and 'foo.d' are
+    # considered part of the same thread as 'foo'
+    _, name = take_unprefix(ascii_lower(name))
+    return instance_thread_key(name)
+
+def instance_thread_key(name):
+    # normalizes an instance name, so that e.g. 'Foo' and 'foo.d' are
+    # considered part of the same thread as 'foo'. un- prefixes only mean
+    # something for classes: 'unix' and 'ix' are different instances.
+    name = ascii_lower(name)
+    while name.endswith('.d'):
+        name = name[:-2]
+    return name
+
+# times are stored in the database as integer microseconds since the epoch,
+# and used everywhere else as naive datetimes in local time
+
+def to_epoch_us(time):
+    if time is None:
+        return None
+    return int(time.replace(microsecond=0).timestamp()) * 1000000 + \
+        time.microsecond
+
+def from_epoch_us(us):
+    if us is None:
+        return None
+    seconds, microseconds = divmod(us, 1000000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=microseconds)
+
+_time_units = {
+    's': timedelta(seconds=1), 'sec': timedelta(seconds=1),
+    'secs': timedelta(seconds=1), 'second': timedelta(seconds=1),
+    'seconds': timedelta(seconds=1),
+    'm': timedelta(minutes=1), 'min': timedelta(minutes=1),
+    'mins': timedelta(minutes=1), 'minute': timedelta(minutes=1),
+    'minutes': timedelta(minutes=1),
+    'h': timedelta(hours=1), 'hour': timedelta(hours=1),
+    'hours': timedelta(hours=1),
+    'd': timedelta(days=1), 'day': timedelta(days=1),
+    'days': timedelta(days=1),
+    'w': timedelta(weeks=1), 'week': timedelta(weeks=1),
+    'weeks': timedelta(weeks=1),
+}
+
+_duration = re.compile(r'\s*(\d+(?:\.\d*)?)\s*([a-z]+)\s*')
+_date = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+def parse_duration(text):
+    # e.g. '2h', '90 min' or '1.5 days'
+    match = _duration.fullmatch(text.lower())
+    unit = match and match.group(2)
+    if unit not in _time_units:
+        raise ValueError('invalid duration {!r}'.format(text))
+    return float(match.group(1)) * _time_units[unit]
+
+def parse_time(text, now=None):
+    # parses a point in time: 'now', 'today', 'yesterday' (both at
+    # midnight), a duration followed by 'ago' (like '2h ago'), or a date
+    # and time in ISO 8601 format (like '2026-01-01' or '2026-01-01 13:00')
+    now = now or datetime.now()
+    text = text.strip().lower()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if text == 'now':
+        return now
+    elif text == 'today':
+        return midnight
+    elif text == 'yesterday':
+        return midnight - timedelta(days=1)
+    elif text.endswith(' ago'):
+        return now - parse_duration(text[:-len(' ago')])
+
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError('invalid time {!r}'.format(text)) from None
+
+def parse_period(text, now=None):
+    # parses a period of time, returning the time it starts at and the time
+    # it ends before (None if it hasn't ended): 'last' followed by a
+    # duration (like 'last 2h'), 'today', 'yesterday', or a date (like
+    # '2026-01-01'). anything else parse_time accepts is the period from
+    # then on.
+    now = now or datetime.now()
+    text = text.strip().lower()
+
+    if text.startswith('last '):
+        return now - parse_duration(text[len('last '):]), None
+
+    start = parse_time(text, now)
+    if (text in ('today', 'yesterday')) or _date.fullmatch(text):
+        return start, start + timedelta(days=1)
+    return start, None
@@ -9,49 +9,64 @@ import time
 
 from datetime import datetime
 
-from zpipe.python import zpipe
-
 from configmanager import ConfigManager
 from db import Database
+from eventloop import EventLoop
+from fakezpipe import make_zpipe
+from ingest import Ingester
+from instrumentation import QueryProfiler, describe_query, stats, timed
+from subscriptions import DEFAULT_SUBSCRIBE_CHUNK_SIZE, SubscriptionSender
 from ui.commandline import CommandLine, parse_cmdline_into_events
 from ui.composer import ZephyrgramComposer
 from ui.mainwindow import MainWindow
+from ui.popup import Popup
+from ui.render import RenderScheduler
+from ui.screen import CursesScreen
+from ui.statswindow import StatsWindow
 from ui.statusbar import StatusBar
-from util import get_principal, take_unprefix
-from zephyrgram import Zephyrgram
-
-# value assigned to the SIGWINCH signal in Linux on x86, arm, sparc and
-# most other architectures, according to the manpage signal(7)
-SIGWINCH = 28
+from util import get_principal
 
 class Wagtail:
     def __init__(self):
         self.principal = get_principal()
 
         self.config = ConfigManager(self)
-        self.db = Database(self)
+        stats.enabled = getattr(self.config, 'collect_stats', True)
+        self.event_loop = EventLoop(sys.stdin)
+        self.profiler = None
+        if getattr(self.config, 'profile_queries', False):
+            self.profiler = QueryProfiler(
+                getattr(self.config, 'slow_query_threshold', 0.01),
+                getattr(self.config, 'slow_query_log_size', 20))
+        self.db = Database(self, writer_thread=getattr(self.config,
+            'database_writer_thread', False), profiler=self.profiler)
 
         self.zgram_queue = queue.Queue()
         self.error_queue = queue.Queue()
 
         def zgram_handler(zp, zgram):
             self.zgram_queue.put(zgram)
-            # we send a SIGWINCH signal to ourselves,
-            # making ncurses think that the window was resized.
-            # this is the best way I know of to interrupt ncurses
-            # in blocking mode.
-            os.kill(os.getpid(), SIGWINCH)
+            self.wakeup()
         def error_handler(error):
             self.error_queue.put(error)
-            os.kill(os.getpid(), SIGWINCH)
-
+            self.wakeup()
 
-        self.zpipe = zpipe.ZPipe(['./zpipe/zpipe'],
+        # WAGTAIL_ZPIPE can run zpipe from elsewhere, or replace it with
+        # the fake one (see fakezpipe.py)
+        self.zpipe = make_zpipe(os.getenv('WAGTAIL_ZPIPE', './zpipe/zpipe'),
             zgram_handler, error_handler)
 
-        self.zpipe.subscribe('message', '*', self.principal)
-        for class_, instance, recipient, _ in self.db.get_subscriptions():
-            self.zpipe.subscribe(class_, instance, recipient)
+        # the subscriptions are sent from the main loop, a chunk at a time,
+        # so that the UI comes up right away
+        self.subscriber = SubscriptionSender(self, self.zpipe,
+            getattr(self.config, 'subscribe_chunk_size',
+                DEFAULT_SUBSCRIBE_CHUNK_SIZE))
+        self.subscriber.subscribe([('message', '*', self.principal)] +
+            [(class_, instance, recipient) for class_, instance, recipient, _
+                in self.db.get_subscriptions()],
+            description='Subscribing')
+
+        self.ingester = Ingester(self, self.zgram_queue)
 
     def __enter__(self):
         return self
@@ -59,6 +74,16 @@ class Wagtail:
     def __exit__(self, exc_type, exc_value, traceback):
         self.db.close()
         self.zpipe.close()
+        self.event_loop.close()
+
+        dump_path = getattr(self.config, 'stats_dump_path', None)
+        if dump_path is not None:
+            stats.dump(os.path.expanduser(dump_path))
+
+    def wakeup(self):
+        # called from other threads, to make the main loop take new
+        # zephyrgrams from the queue and run database write callbacks
+        self.event_loop.wakeup()
 
     def get_config_path(self):
         if os.getenv('XDG_CONFIG_HOME') is not None:
@@ -104,6 +129,7 @@ class Wagtail:
         self.window_stack.pop().close()
 
     def event_send_zephyrgrams(self, zgrams):
+        saved = []
         for zgram in zgrams:
             self.zpipe.zwrite(zgram.to_zpipe())
 
@@ -114,8 +140,9 @@ class Wagtail:
                 zgram.time = zgram.time or datetime.now()
                 zgram.sender = zgram.sender or self.principal
                 self.db.append_message(zgram)
+                saved.append(zgram)
 
-        self.main_window.redraw() # to display the personals
+        self.main_window.messages_added(saved) # to display the personals
 
     def event_subscribe(self, class_, instance, recipient):
         new_subs = self.db.subscribe(class_, instance, recipient)
@@ -123,8 +150,7 @@ class Wagtail:
         if len(new_subs) == 0:
             self.status_bar.set_status('Error: Already subscribed.')
         else:
-            for args in new_subs:
-                self.zpipe.subscribe(*args)
+            self.subscriber.subscribe(new_subs)
             self.status_bar.set_status('Subscribed successfully.')
 
     def event_unsubscribe(self, class_, instance, recipient):
@@ -135,8 +161,7 @@ class Wagtail:
                 ('Error: either not subscribed, or trying to unsubscribe '
                  'from unclass.'))
         else:
-            for args in unsubs:
-                self.zpipe.unsubscribe(*args)
+            self.subscriber.unsubscribe(unsubs)
             self.status_bar.set_status('Unsubscribed successfully.')
 
     def event_import_zsubs(self, path):
@@ -145,7 +170,7 @@ class Wagtail:
 
         try:
             with open(path) as zsubs:
-                processed = 0
+                triples = []
                 skipped = 0
                 for line in zsubs:
                     if len(line.strip()) == 0:
@@ -155,28 +180,97 @@ class Wagtail:
                     if len(parts) != 3:
                         skipped += 1
                     else:
-                        for sub in self.db.subscribe(*parts):
-                            self.zpipe.subscribe(*sub)
-                        processed += 1
-
-            self.status_bar.set_status(
-                'Done, {} lines processed successfuly, {} skipped.'.format(
-                    processed, skipped))
+                        triples.append(tuple(parts))
         except FileNotFoundError:
             self.status_bar.set_status(
                 'Error: file {} not found.'.format(path))
+            return
+
+        # all the new subscriptions are stored in one transaction, and sent
+        # to zpipe from the main loop, which reports the progress
+        new_subs = self.db.subscribe_many(triples)
+        job = self.subscriber.subscribe(new_subs,
+            description='Importing {} ({} lines processed, {} skipped)'.format(
+                path, len(triples), skipped))
+        if len(new_subs) == 0:
+            self.status_bar.set_status(job.status())
+
+    def event_subscription_progress(self, job):
+        self.status_bar.set_status(job.status())
+
+    def event_messages_committed(self, zgrams):
+        self.main_window.messages_added(zgrams)
+
+    def event_stats(self):
+        self.window_stack.append(StatsWindow(self, stats))
+
+    def event_popup_close(self):
+        assert isinstance(self.window_stack[-1], Popup)
+        self.window_stack.pop().close()
+
+    def event_stats_reset(self):
+        stats.reset()
+        self.status_bar.set_status('Stats reset.')
+
+    def event_stats_dump(self, path):
+        try:
+            stats.dump(os.path.expanduser(path))
+        except OSError as error:
+            self.status_bar.set_status('Error: {}'.format(error.strerror))
+        else:
+            self.status_bar.set_status('Stats written to {}.'.format(path))
+
+    def event_explain(self):
+        filter = self.main_window.filter
+        name = filter.name() or 'no filter'
+
+        rows = []
+        for statement, plan in self.db.explain(filter):
+            rows.extend(describe_query(statement, plan))
+
+        if self.profiler is not None:
+            slow_queries = self.profiler.slow_queries_for(filter.name())
+            rows.append('{} slow queries (at least {:.1f} ms):'.format(
+                len(slow_queries), self.profiler.threshold * 1000))
+            rows.append('')
+            for query in slow_queries:
+                rows.append('{} took {:.1f} ms:'.format(
+                    datetime.fromtimestamp(query.time).strftime('%H:%M:%S'),
+                    query.duration * 1000))
+                rows.extend(describe_query(query.statement, query.plan))
+        else:
+            rows.append('set profile_queries = True in the config to log '
+                'slow queries.')
+
+        self.window_stack.append(Popup(self, 'query plans for {}'.format(
+            name), rows))
 
     def event_reload_config(self):
-        self.config.reload()
-        self.main_window.redraw() # styling rules might've changed
+        try:
+            self.config.reload()
+        except (SyntaxError, ValueError) as error:
+            # e.g. a typo in the config, or a broken style rule. the
+            # previous version of the config is kept.
+            self.status_bar.set_status('Error in config: {}'.format(error))
+        # styling rules might've changed
+        self.renderer.mark_dirty(self.main_window)
 
     def event_filter(self, new_filter):
         self.main_window.set_filter(new_filter)
 
+    def event_goto(self, time):
+        if not self.main_window.go_to_time(time):
+            self.status_bar.set_status('No messages after {}.'.format(
+                time.strftime('%Y-%m-%d %H:%M')))
+
+    @timed('handle_events')
     def handle_events(self, events):
         for event, *event_args in events:
             # call self.event_{eventname}(*event_args)
+            start = time.perf_counter()
             getattr(self, 'event_{}'.format(event))(*event_args)
+            stats.record('event.{}'.format(event),
+                time.perf_counter() - start)
 
     def main_curses(self, screen):
         # tell the terminal to not send us SIGINTs when Ctrl+C is pressed
@@ -184,62 +278,81 @@ class Wagtail:
         tty_attributes[3] &= ~termios.ISIG
         termios.tcsetattr(sys.stdin, termios.TCSANOW, tty_attributes)
 
-        self.screen = screen
+        self.screen = CursesScreen(screen)
 
-        curses.use_default_colors()
-        curses.curs_set(0)
+        self.screen.use_default_colors()
+        self.screen.curs_set(0)
 
+        self.window_stack = []
+        self.renderer = RenderScheduler(self)
         self.status_bar = StatusBar(self)
         self.main_window = MainWindow(self)
-        curses.doupdate()
 
         # this window stack kind of duplicates the one kept by
         # curses.panel — perhaps we should just use that directly?
         self.window_stack = [self.status_bar, self.main_window]
+        self.renderer.render(force=True)
 
         self.should_quit = False
 
+        self.screen.nodelay(True)
+        self.event_loop.install_resize_handler()
+
+        while not self.should_quit:
+            # if a frame is waiting to be rendered, we only wait until it
+            # is due
+            input_ready, woken, resized = self.event_loop.wait(
+                self.renderer.timeout())
+
+            if resized:
+                self.resize()
+
+            if woken:
+                self.ingester.drain()
+                self.db.run_write_callbacks()
+                self.handle_events(self.subscriber.run())
+
+            if input_ready or resized:
+                self.handle_input()
+                self.renderer.touch()
+
+            while not self.error_queue.empty():
+                error = self.error_queue.get()
+                job = self.subscriber.blame(error)
+                if (job is not None) and (job.description is not None):
+                    self.handle_events([('subscription_progress', job)])
+                else:
+                    self.status_bar.set_status('Error in {}: {}'.format(
+                        error.operation, error.message))
+
+            self.renderer.render()
+
+    def resize(self):
+        size = os.get_terminal_size(sys.__stdout__.fileno())
+        self.screen.resizeterm(size.lines, size.columns)
+
+        for window in self.window_stack:
+            window.update_size()
+
+    def handle_input(self):
+        # reads and handles all the keys that are available, without blocking
         while True:
-            key = screen.get_wch() # blocks indefinitely
+            try:
+                key = self.screen.get_wch()
+            except curses.error:
+                break
 
             if key == curses.KEY_RESIZE:
-                # this could be either a legitimate SIGWINCH, notifying us that
-                # the terminal was resized,
-                # or a fake SIGWINCH, generated by the zgram_handler
-                # (see __init__) notifying us that we have new zephyrgrams
-                # to take from the queue
-                while not self.zgram_queue.empty():
-                    zgram = Zephyrgram.from_zpipe(self.zgram_queue.get())
-                    self.db.append_message(zgram)
-
-                    # if this is in class 'ununclass', and we aren't yet
-                    # subscribed to 'unununclass', do so
-                    undepth, class_stripped = take_unprefix(zgram.class_)
-                    new_unclass = 'un' + zgram.class_
-                    for instance, recipient in self.db.update_undepth(
-                        class_stripped, undepth + 1):
-                        self.zpipe.subscribe(new_unclass, instance, recipient)
-
-                for window in self.window_stack:
-                    window.update_size()
-            else:
-                self.status_bar.clear_status()
-
-                self.should_quit = False
-
-                events = self.window_stack[-1].handle_keypress(key)
-                self.handle_events(events)
-
-                if self.should_quit:
-                    break
-
-            if not self.error_queue.empty():
-                error = self.error_queue.get()
-                self.status_bar.set_status('Error in {}: {}'.format(
-                    error.operation, error.message))
+                # resizes are handled by the event loop, but resizeterm
+                # leaves one of these in the input queue
+                continue
 
-            curses.doupdate()
+            self.status_bar.clear_status()
+            events = self.window_stack[-1].handle_keypress(key)
+            self.handle_events(events)
 
+            if self.should_quit:
+                break
 
     def main(self):
         curses.wrapper(self.main_curses)
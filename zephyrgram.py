@@ -2,9 +2,34 @@ from datetime import datetime
 
 from zpipe.python.zpipe import Zephyrgram as ZpipeZephyrgram
 
+from util import from_epoch_us, to_epoch_us
+
+def _decode_bool(value):
+    return None if value is None else bool(value)
+
+# for each field read from the database: its column, and how to decode it
+_SQL_FIELDS = {
+    'sender': ('sender', None),
+    'class_': ('class', None),
+    'instance': ('instance', None),
+    'recipient': ('recipient', None),
+    'opcode': ('opcode', None),
+    'auth': ('auth', _decode_bool),
+    'time': ('time', from_epoch_us),
+    'signature': ('signature', None),
+    'body': ('body', None),
+}
+
 class Zephyrgram:
+    # messages read from the database keep their sqlite3.Row, and each
+    # field is only taken from it (and decoded) the first time it is used:
+    # until then its slot is empty, so reading it ends up in __getattr__.
+    __slots__ = ('rowid', 'sender', 'class_', 'instance', 'recipient',
+        'opcode', 'auth', 'time', 'signature', 'body', '_row')
+
     def __init__(self, rowid, sender, class_, instance, recipient, opcode, auth,
         time, signature, body):
+        self._row = None
         self.rowid = rowid
         self.sender = sender
         self.class_ = class_
@@ -56,16 +81,28 @@ class Zephyrgram:
 
     @classmethod
     def from_sql(cls, row):
-        return cls(rowid=row['id'],
-            sender=row['sender'],
-            class_=row['class'],
-            instance=row['instance'],
-            recipient=row['recipient'],
-            opcode=row['opcode'],
-            auth=row['auth'],
-            time=row['time'],
-            signature=row['signature'],
-            body=row['body'])
+        # row can have any subset of the columns (see db.MESSAGE_COLUMNS),
+        # as long as it has the id
+        zgram = cls.__new__(cls)
+        zgram._row = row
+        zgram.rowid = row['id']
+        return zgram
+
+    def __getattr__(self, name):
+        if (name not in _SQL_FIELDS) or (self._row is None):
+            raise AttributeError(name)
+
+        column, decode = _SQL_FIELDS[name]
+        try:
+            value = self._row[column]
+        except IndexError:
+            raise AttributeError('{} was not read from the database'.format(
+                column)) from None
+
+        if decode is not None:
+            value = decode(value)
+        setattr(self, name, value)
+        return value
 
     def to_sql(self):
         return {
@@ -76,7 +113,7 @@ class Zephyrgram:
             'recipient': self.recipient,
             'opcode': self.opcode,
             'auth': self.auth,
-            'time': self.time,
+            'time': to_epoch_us(self.time),
             'signature': self.signature,
             'body': self.body
         }